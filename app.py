@@ -1,8 +1,19 @@
-from modules.extract import preview, export
+from modules.extract import export, warm_up, DEFAULT_WORKERS, DEFAULT_ENGINE, ENGINES, EXPORT_FORMATS
+from modules.exporters import export_tables
+from modules.snapshots import export_delta
+from modules.jobs import get_job_manager
+from modules.fields import TALENT_LEVELS, TALENT_DETAILS_TABLE, TALENT_DETAIL_COLUMNS
+from modules.data_store import get_data_store, DEFAULT_RANK_LIMIT
+from modules.city_cache import get_city_cache
+from modules.driver_pool import pool_stats, chrome_memory, CHROME_MEMORY_BUDGET_MB
+from modules.metrics import metrics
 import streamlit as st
 import datetime
 import time
 
+# Seconds between reruns while a preview job is running
+JOB_POLL_SECONDS = 1
+
 
 def min_sec(start_time, end_time):
     minutes = round((end_time - start_time) / 60)
@@ -10,6 +21,13 @@ def min_sec(start_time, end_time):
     return f"{minutes if minutes > 0 else ''} {'minute' if minutes > 0 else ''}{'s' if minutes > 1 else ''} {'and' if minutes > 0 else ''} {seconds} second{'s' if seconds > 1 else ''}"
 
 
+@st.cache_resource(show_spinner=False)
+def warm_browser():
+    # Once per server process: a headless browser starts in the background while the page renders
+    warm_up(DEFAULT_WORKERS)
+    return True
+
+
 def main():
     # import list of provinces from txt file "provinces_list.txt"
     with open('./provinces_list.txt', 'r') as f:
@@ -27,13 +45,14 @@ def main():
                 Streamlit
                 """
                        })
+    warm_browser()
 
     st.title('🏙 DigiCitiesPH')
     st.write(
         'A web app that extracts the profile of cities of the Philippines from the website [Digital Cities PH](https://www.digitalcitiesph.com/).')
     st.info('**Tip:** For faster preview and export (cached after preview), choose a province with fewer cities in Simple mode.', icon="💡")
 
-    tab1, tab2 = st.tabs(["⛏ Extract", "🚚 Export"])
+    tab1, tab2, tab3 = st.tabs(["⛏ Extract", "🚚 Export", "📊 Explore"])
 
     with tab1:
         preview_container = st.container()
@@ -49,7 +68,25 @@ def main():
 
         selected_mode = preview_container.selectbox(
             'Mode of extraction',
-            ["Simple", "Advanced"], placeholder="Select a mode of extraction", disabled=True)
+            ["Simple", "Advanced"], placeholder="Select a mode of extraction")
+
+        disciplines = None
+        if selected_mode == "Advanced":
+            selected_levels = preview_container.multiselect(
+                'Talent details', list(TALENT_LEVELS), default=list(TALENT_LEVELS),
+                help='School levels whose graduates by field and specialization are extracted; fewer levels extract faster')
+            # All levels is the default run, shared with everyone extracting the province in Advanced mode
+            if len(selected_levels) < len(TALENT_LEVELS):
+                disciplines = tuple(level for level in TALENT_LEVELS if level in selected_levels)
+
+        engine_labels = {"selenium": "Browser (Selenium)", "http": "HTTP (browser fallback)"}
+        engine = preview_container.selectbox(
+            'Extraction engine', ENGINES, index=ENGINES.index(DEFAULT_ENGINE), format_func=engine_labels.get,
+            help='HTTP fetches pages without a browser and only opens one for cities it cannot read')
+
+        workers = preview_container.slider(
+            'Parallel browsers', min_value=1, max_value=8, value=DEFAULT_WORKERS,
+            help='Number of headless browsers scraping cities at the same time')
 
         if selected_mode == "Simple":
             selected_mode_description.write("""
@@ -62,30 +99,56 @@ def main():
                      This mode extracts general information and more details of cities of selected province. 
                      
                      Talent table will include not only total number of graduates of school levels but also graduates of specific fields and specializations, and number of institutions by school level.
+
+                     Graduates by field and specialization are in the additional Talent Details table. City profiles already extracted in Simple mode are reused, so only the talent details are extracted.
                      """)
 
-        if st.button('Preview', disabled=not preview_disabled, type='primary'):
+        preview_col, retry_col = st.columns([1, 5])
+        no_levels = disciplines == ()
+        preview_clicked = preview_col.button('Preview', disabled=not preview_disabled or no_levels, type='primary')
+        retry_clicked = retry_col.button('Retry failed cities', disabled=not preview_disabled or no_levels,
+                                         help='Extract again only the cities that failed in the last preview')
+
+        jobs = get_job_manager()
+        if preview_clicked or retry_clicked:
+            # Joins the job of another session extracting the same province; retrying replaces a finished job,
+            # and the checkpoint keeps finished cities, so only failed ones are scraped again
+            job = jobs.submit(selected_province, selected_mode.lower(), engine, disciplines=disciplines, refresh=retry_clicked,
+                              skip_error=skip_error, workers=workers)
+            st.session_state['job'] = job.key
+        job = jobs.get(*st.session_state['job']) if 'job' in st.session_state else None
+
+        if job is not None:
             status_notif = st.empty()
-            status_notif.info(
-                f'Extracting data from {selected_province}, please wait...', icon="🔍")
-            start_time = time.time()
-            try:
-                talent_table, infra_table, business_table, digital_table = preview(
-                    selected_province, selected_mode.lower(), skip_error=False)
-                
-            except Exception as e:
+            done, total = job.progress()
+            if job.active:
+                status_notif.info(
+                    f'Extracting data from {job.province}, {done} of {total or "?"} cities done. Tables below fill in as cities finish...', icon="🔍")
+                st.progress(done / total if total else 0.0)
+            elif job.status == 'failed':
                 status_notif.error(
-                    f'The extractor broke down in the process, re-attempting extraction while skipping errors... What happened: {e}', icon="🚧")
-                time.sleep(5)
-                talent_table, infra_table, business_table, digital_table = preview(
-                    selected_province, selected_mode.lower(), skip_error=True)
-                skip_error = True
+                    f'The extractor broke down in the process. Cities finished so far are saved, press Preview again to resume. What happened: {job.error}', icon="🚧")
+            else:
+                failures = job.failures()
+                if failures.empty:
+                    status_notif.success(
+                            f'{job.province} province {job.mode} extraction finished! ({min_sec(job.started, job.finished)}). The data is ready to export, please proceed to 🚚 Export tab', icon="✅")
+                else:
+                    status_notif.warning(
+                            f'{job.province} province {job.mode} extraction finished with {len(failures)} failed cities ({min_sec(job.started, job.finished)}). Their rows are empty; press **Retry failed cities** to extract only those.', icon="⚠️")
+                    with st.expander('Failed cities'):
+                        st.dataframe(failures, use_container_width=True)
+                changes = job.changes()
+                if changes is not None:
+                    with st.expander(f'Changes since the previous extraction ({len(changes)} values)'):
+                        st.write('Values added, removed or changed per city and column since the last extraction of this province (all values are added on the first one). Export them from the 🚚 Export tab.')
+                        if job.cached:
+                            st.caption(f'{len(job.cached)} cities came from the saved city profiles and are not compared; clear them in the 🚚 Export tab to extract every city again.')
+                        st.dataframe(changes, use_container_width=True)
 
-            status_notif.success(
-                    f'{selected_province} province {selected_mode} extraction finished! ({min_sec(start_time, time.time())}). The data is ready to export, please proceed to 🚚 Export tab', icon="✅")
+            talent_table, infra_table, business_table, digital_table, *talent_details = job.tables()
 
-            talent_tab, infra_tab, business_tab, digital_tab = st.tabs(
-                ["Talent", "Infrastructure", "Business Environment", "Digital Parameters"])
+            talent_tab, infra_tab, business_tab, digital_tab, *talent_details_tab = st.tabs(job.table_names())
 
             with talent_tab:
                 # display talent_table dataframe in streamlit
@@ -100,6 +163,36 @@ def main():
             with digital_tab:
                 st.dataframe(digital_table, use_container_width=True)
 
+            if talent_details:
+                with talent_details_tab[0]:
+                    # graduates by field and specialization, one row per specialization
+                    st.dataframe(talent_details[0], use_container_width=True)
+
+        with st.expander('🩺 Diagnostics'):
+            st.write('Where extraction time goes: driver start-up, navigation, readiness waits, tab clicks and field extraction (seconds).')
+            browsers = pool_stats()
+            if browsers:
+                st.write(f'Headless browsers: {sum(pool["drivers"] for pool in browsers)} running, '
+                         f'{chrome_memory() / 2 ** 20:.0f} of {CHROME_MEMORY_BUDGET_MB:.0f} MB Chrome memory budget used (shared by all users).')
+                st.dataframe(browsers, use_container_width=True)
+            span_summary = metrics.summary()
+            if not span_summary:
+                st.write('No timings recorded yet, run a preview first.')
+            else:
+                st.dataframe(span_summary, use_container_width=True)
+                st.write('Per province:')
+                st.dataframe(metrics.per_province(), use_container_width=True)
+                st.write('Per city:')
+                st.dataframe(metrics.per_city(), use_container_width=True)
+                json_col, prometheus_col, reset_col = st.columns(3)
+                json_col.download_button('Download JSON', data=metrics.to_json(indent=2),
+                                         file_name='digicitiesph-metrics.json', mime='application/json')
+                prometheus_col.download_button('Download Prometheus text', data=metrics.to_prometheus(),
+                                               file_name='digicitiesph-metrics.prom', mime='text/plain')
+                if reset_col.button('Reset timings'):
+                    metrics.clear()
+                    st.rerun()
+
     with tab2:
         col1, col2 = st.columns(2)
 
@@ -115,21 +208,42 @@ def main():
                 'Clear cache (Preview and extraction will take a while initially):')
             if st.button('Clear cache'):
                 st.cache_data.clear()
+                # The next Preview extracts the province again instead of showing a finished job
+                get_job_manager().clear_finished()
                 st.success('Cache cleared!')
+            st.write(
+                f'Saved city profiles ({len(get_city_cache())} cities, kept across restarts and shared by all users):')
+            if st.button('Clear saved city profiles'):
+                st.cache_data.clear()
+                get_city_cache().clear()
+                get_job_manager().clear_finished()
+                st.success('Saved city profiles cleared!')
         with col2:
             st.text_input('Select province',
                           placeholder=selected_province, disabled=True)
             st.text_input('Mode of extraction:',
                           placeholder=selected_mode, disabled=True)
 
+            filetypes = {'Excel': 'excel', 'CSV': 'csv', 'CSV (gzip)': 'csv.gz', 'Parquet': 'parquet'}
+            filetype_descriptions = {
+                'excel': 'worksheets in single `.xlsx` file (Excel)',
+                'csv': 'separated by `.csv` files (CSV) in zipped file',
+                'csv.gz': 'separated by gzip-compressed `.csv.gz` files in zipped file',
+                'parquet': 'separated by `.parquet` files in zipped file',
+            }
             selected_filetype = st.selectbox(
                 'Select a file type',
-                ['Excel', 'CSV'], disabled=True)
+                list(filetypes))
+            filetype = filetypes[selected_filetype]
+            file_extension, file_mime = EXPORT_FORMATS[filetype]
             st.write(f"""
                     You selected: {selected_filetype}
 
-                    Tables will be {'separated by `.csv` files (CSV) in zipped file' if selected_filetype == 'CSV' else 'worksheets in single `.xlsx` file (Excel)'}
+                    Tables will be {filetype_descriptions[filetype]}
                     """)
+            changes_only = st.checkbox(
+                'Only changes since the previous extraction',
+                help='Delta export: one row per value added, removed or changed since the last extraction of the province. Preview the province first.')
 
             with st.expander('Export'):
                 'Are you sure about that?'
@@ -142,17 +256,78 @@ def main():
                         st.error(
                             'Province name does not match. Please try again.')
                     else:
-                        # export data
-                        exported_file = export(selected_province, selected_mode.lower(
-                        ), selected_filetype.lower(), skip_error)
-                        st.success('Export successful!')
-                        st.download_button(label=f"Download {'Zip File' if selected_mode.lower() == 'csv' else 'Excel File'}",
-                                           data=exported_file, file_name=f"output.{'zip' if selected_mode.lower() == 'csv' else 'xlsx'}")
+                        # export data, reusing the tables of a finished preview job instead of extracting again
+                        finished_job = jobs.get(selected_province, selected_mode.lower(), engine, disciplines)
+                        exported_file = None
+                        file_name = f"{selected_province} - Digital Cities PH.{file_extension}"
+                        if changes_only:
+                            changes = finished_job.changes() if finished_job is not None else None
+                            if changes is None:
+                                st.error('No finished extraction to compare yet. Preview the province first.')
+                            else:
+                                exported_file = export_delta(changes, filetype)
+                                file_name = f"{selected_province} - Digital Cities PH changes.{file_extension}"
+                        elif finished_job is not None and finished_job.status == 'done':
+                            exported_file = export_tables(finished_job.tables(), filetype, finished_job.table_names())
+                        else:
+                            exported_file = export(selected_province, selected_mode.lower(
+                            ), filetype, skip_error, workers=workers, engine=engine, disciplines=disciplines)
+                        if exported_file is not None:
+                            st.success('Export successful!')
+                            st.download_button(label=f"Download {'Zip File' if file_extension == 'zip' else 'Excel File'}",
+                                               data=exported_file, file_name=file_name, mime=file_mime)
+
+    with tab3:
+        store = get_data_store()
+        loaded = store.provinces()
+        st.write(
+            f'Latest extraction of {len(loaded)} provinces ({int(loaded["Cities"].sum())} cities), saved as previews finish. Rank and aggregate cities across provinces without extracting again.')
+        if st.button('Load saved city profiles', help='Add every city profile saved in the last 7 days (e.g. by the command line or before a restart)'):
+            store.load_city_cache(get_city_cache())
+            st.rerun()
+
+        if loaded.empty:
+            st.info('Nothing to explore yet, run a preview first.', icon="📭")
+        else:
+            columns = store.value_columns()
+            rank_tab, aggregate_tab, sql_tab = st.tabs(['Rank cities', 'Aggregate', 'SQL'])
+
+            with rank_tab:
+                rank_column = st.selectbox('Rank cities by', columns, index=columns.index('Internet Bandwidth'),
+                                           help='Text values are ranked by their first number')
+                order_col, limit_col = st.columns(2)
+                ascending = order_col.radio('Order', ['Highest first', 'Lowest first'], horizontal=True) == 'Lowest first'
+                limit = limit_col.slider('Cities', min_value=5, max_value=100, value=DEFAULT_RANK_LIMIT)
+                rank_provinces = st.multiselect('Provinces', loaded['Province'].tolist(), placeholder='All provinces')
+                st.dataframe(store.rank(rank_column, ascending=ascending, limit=limit, provinces=rank_provinces),
+                             use_container_width=True)
+
+            with aggregate_tab:
+                aggregate_column = st.selectbox('Column', columns, index=columns.index('Total Graduates'), key='aggregate_column')
+                group_by = ['Province']
+                if store.table_of(aggregate_column) == TALENT_DETAILS_TABLE:
+                    group_by = st.multiselect('Group by', ['Province', 'City'] + TALENT_DETAIL_COLUMNS[:-1], default=['Level', 'Field']) or group_by
+                st.dataframe(store.aggregate(aggregate_column, by=group_by), use_container_width=True)
+
+            with sql_tab:
+                st.write('Tables and columns are named as in the exports; quote names with spaces. `number(text)` reads the first number of a text value.')
+                sql = st.text_area('Read-only SQL query',
+                                   value='SELECT Province, City, "Internet Bandwidth" FROM "Infrastructure"\nORDER BY number("Internet Bandwidth") DESC\nLIMIT 20')
+                if st.button('Run query'):
+                    try:
+                        st.dataframe(store.query(sql), use_container_width=True)
+                    except Exception as e:
+                        st.error(f'Query failed: {e}')
 
     st.markdown('''<hr>''', unsafe_allow_html=True)
     st.markdown(
         '''<small>Support by giving [**this app**](https://github.com/frvfrvr/digicitiesph) a ⭐ and follow the [**developer on GitHub**](https://github.com/frvfrvr) for more apps like this. Thank you.</small>''', unsafe_allow_html=True)
 
+    if job is not None and job.active:
+        # Poll the background job: rerun the script to render the cities finished since the last run
+        time.sleep(JOB_POLL_SECONDS)
+        st.rerun()
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,118 @@
+"""End-to-end benchmark of preview() and export() against the local mock site (no network needed)
+
+Times the uncached functions behind them (extract_province, export_province), so every run is cold.
+Runs on a small, medium and large province and reports cities per second, p50/p95 seconds per city
+and peak Python memory (tracemalloc). Save a run with --save and check a later one against it with
+--compare; the exit code is 1 when throughput, latency or memory regressed beyond --tolerance.
+
+Run from the repository root:
+	python -m benchmarks.bench_end_to_end
+	python -m benchmarks.bench_end_to_end --latency 0.2 --save baseline.json
+	python -m benchmarks.bench_end_to_end --latency 0.2 --compare baseline.json
+"""
+import argparse
+import tempfile
+import tracemalloc
+import logging
+import json
+import time
+import sys
+import os
+
+# Keep the user's city cache and checkpoints out of the benchmark; must be set before importing modules
+os.environ["DIGICITIESPH_CACHE_DIR"] = tempfile.mkdtemp(prefix="digicitiesph-bench-")
+
+from benchmarks.mock_server import start_server
+from modules.metrics import metrics, describe
+from modules import fields
+from modules.extract import extract_province, export_province
+# Imported lazily by the extractor; loaded up front so the first case does not time the import
+from modules import http_engine  # noqa: F401
+
+PROVINCES = {"small": "Batanes", "medium": "Ilocos Norte", "large": "Cebu"}
+# Lower is better for these, higher for cities_per_second
+LOWER_IS_BETTER = ("p50", "p95", "peak_mb")
+
+
+def run(name: str, province: str, call) -> dict:
+	"""Run one benchmark case"""
+	metrics.clear()
+	tracemalloc.start()
+	start = time.perf_counter()
+	call()
+	elapsed = time.perf_counter() - start
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	city_seconds = [span["seconds"] for span in metrics.spans() if span["name"] == "city" and span["province"] == province]
+	stats = describe(city_seconds)
+	return {
+		"case": name,
+		"cities": stats["count"],
+		"seconds": elapsed,
+		"cities_per_second": stats["count"] / elapsed if elapsed else 0.0,
+		"p50": stats["p50"],
+		"p95": stats["p95"],
+		"peak_mb": peak / 2 ** 20,
+	}
+
+
+def regressions(results: list, baseline: list, tolerance: float) -> list:
+	previous = {result["case"]: result for result in baseline}
+	found = []
+	for result in results:
+		before = previous.get(result["case"])
+		if before is None:
+			continue
+		if result["cities_per_second"] < before["cities_per_second"] * (1 - tolerance):
+			found.append(f"{result['case']}: cities/s {before['cities_per_second']:.1f} -> {result['cities_per_second']:.1f}")
+		for key in LOWER_IS_BETTER:
+			if result[key] > before[key] * (1 + tolerance):
+				found.append(f"{result['case']}: {key} {before[key]:.3f} -> {result[key]:.3f}")
+	return found
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--latency", type=float, default=0.05, help="seconds the mock site waits per page")
+	parser.add_argument("--jitter", type=float, default=0.02, help="random extra seconds per page, up to this much")
+	parser.add_argument("--engine", default="http", help='"http", or "selenium" when Chrome is installed')
+	parser.add_argument("--workers", type=int, default=4)
+	parser.add_argument("--filetype", default="csv", help="export format")
+	parser.add_argument("--sizes", nargs="+", default=list(PROVINCES), choices=list(PROVINCES))
+	parser.add_argument("--save", metavar="FILE", help="write the results as JSON")
+	parser.add_argument("--compare", metavar="FILE", help="fail when worse than the results saved in FILE")
+	parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression")
+	args = parser.parse_args()
+	logging.disable(logging.INFO)
+
+	server, fields.BASE_URL = start_server(latency=args.latency, jitter=args.jitter)
+	options = dict(skip_error=False, workers=args.workers, engine=args.engine, use_cache=False)
+	results = []
+	try:
+		for size in args.sizes:
+			province = PROVINCES[size]
+			results.append(run(f"preview {size}", province, lambda: extract_province(province, "simple", **options)))
+			results.append(run(f"export {size}", province, lambda: export_province(province, "simple", args.filetype, **options)))
+	finally:
+		server.shutdown()
+
+	print(f"{args.engine} engine, {args.workers} workers, {args.latency:.3f}s (+{args.jitter:.3f}s) latency per page")
+	print(f"{'Case':<16} {'Cities':>6} {'Seconds':>8} {'Cities/s':>9} {'p50 (s)':>8} {'p95 (s)':>8} {'Peak (MB)':>10}")
+	for result in results:
+		print(f"{result['case']:<16} {result['cities']:>6} {result['seconds']:>8.2f} {result['cities_per_second']:>9.1f} "
+			f"{result['p50']:>8.3f} {result['p95']:>8.3f} {result['peak_mb']:>10.1f}")
+
+	if args.save:
+		with open(args.save, "w") as f:
+			json.dump(results, f, indent=2)
+	if args.compare:
+		with open(args.compare) as f:
+			found = regressions(results, json.load(f), args.tolerance)
+		for regression in found:
+			print(f"Regression: {regression}")
+		if found:
+			sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,54 @@
+"""Table assembly benchmark: per-row pd.concat + per-cell .loc writes (before) vs build_tables (now)
+
+Run from the repository root:
+	python -m benchmarks.bench_table_assembly
+"""
+import timeit
+import pandas as pd
+from modules.fields import POPULATION, fields_for, table_columns
+from modules.tables import build_tables
+
+# Batanes and Guimaras are the smallest provinces, Bohol and Cebu the largest (cities/municipalities)
+PROVINCE_SIZES = {"Batanes": 6, "Bohol": 48, "Cebu": 53, "Cebu x10": 530}
+MODE = "simple"
+
+
+def fake_record(n: int) -> dict:
+	extract_vars = {POPULATION.column: f"{100000 + n:,}".replace(',', '')}
+	for i, field in enumerate(fields_for(MODE)):
+		extract_vars[field.column] = f"{n * 10 + i}" if field.strip_commas else f"Value {n}-{i}"
+	return extract_vars
+
+
+def legacy_assembly(province: str, rows: list) -> list:
+	"""preview()'s former table assembly, kept here as the baseline"""
+	columns = table_columns(MODE)
+	dfs = []
+	for df_columns in columns:
+		df = pd.DataFrame([], columns=['Province', 'City', 'Population'])
+		for i in df_columns:
+			df[i] = None
+		dfs.append(df)
+	for _, city_name, _ in rows:
+		new_row = pd.DataFrame({'Province': province, 'City': city_name}, index=[0])
+		dfs = [pd.concat([df, new_row], ignore_index=True) for df in dfs]
+	for _, city_name, extract_vars in rows:
+		for df, df_columns in zip(dfs, columns):
+			df.loc[df["City"] == city_name, "Population"] = extract_vars["Population"]
+			for i in df_columns:
+				df.loc[df["City"] == city_name, i] = extract_vars[i]
+	return dfs
+
+
+def main():
+	print(f"{'Province':<10} {'Cities':>6} {'Before (ms)':>12} {'Now (ms)':>10} {'Speed-up':>9}")
+	for province, size in PROVINCE_SIZES.items():
+		rows = [(province, f"City {n}", fake_record(n)) for n in range(size)]
+		repeat = 3 if size > 100 else 10
+		before = min(timeit.repeat(lambda: legacy_assembly(province, rows), number=1, repeat=repeat))
+		now = min(timeit.repeat(lambda: build_tables(rows, MODE), number=1, repeat=repeat))
+		print(f"{province:<10} {size:>6} {before * 1000:>12.1f} {now * 1000:>10.1f} {before / now:>8.0f}x")
+
+
+if __name__ == "__main__":
+	main()
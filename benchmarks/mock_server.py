@@ -0,0 +1,166 @@
+"""Local stand-in for the Digital Cities PH website
+
+Serves province and city profile pages under the site's URL layout
+(`/location-profiles/provinces/<name>/` and `/location-profiles/cities/<name>/`) with a configurable
+latency. Pages recorded from the real site (see `--record`) are served from `benchmarks/fixtures/`;
+any other province or city gets a generated page with the same selectors.
+
+	python -m benchmarks.mock_server --port 8765 --latency 0.2
+	python -m benchmarks.mock_server --record Batanes Cebu
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import unquote
+import argparse
+import threading
+import random
+import time
+import os
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# Generated provinces have this many cities unless the province name is listed here
+DEFAULT_CITIES = 10
+PROVINCE_SIZES = {"batanes": 6, "guimaras": 5, "ilocos norte": 23, "bohol": 48, "cebu": 53}
+
+
+def display_name(url_name: str) -> str:
+	return unquote(url_name).title()
+
+
+def generated_city_names(province: str) -> list:
+	return [f"{province} Town {n}" for n in range(1, PROVINCE_SIZES.get(province.lower(), DEFAULT_CITIES) + 1)]
+
+
+def province_page(province: str) -> str:
+	municipalities = "".join(
+		f'<div class="municipality"><a href="/location-profiles/cities/{name.lower().replace(" ", "%20")}/"><h6>{name}</h6></a></div>'
+		for name in generated_city_names(province)
+	)
+	return f"<html><head><title>{province} | Digital Cities PH</title></head><body><main>{municipalities}</main></body></html>"
+
+
+# Fields of study and their specializations in the talent accordions of generated pages
+DISCIPLINES = {
+	"Information Technology": ["Computer Science", "Information Systems", "Software Engineering"],
+	"Engineering": ["Civil Engineering", "Electrical Engineering"],
+	"Business Administration": ["Accountancy", "Marketing Management"],
+	"Education": [],
+}
+
+
+def talent_disciplines(number, level: int) -> str:
+	disciplines = []
+	for d, (field, specializations) in enumerate(DISCIPLINES.items()):
+		items = "".join(
+			f'<div class="specialization"><p class="name">{specialization}</p><p class="graduates">{number(level * 100 + d * 10 + s)}</p></div>'
+			for s, specialization in enumerate(specializations)
+		)
+		disciplines.append(f'<div class="discipline"><p class="name">{field}</p><p class="graduates">{number(level * 100 + d * 10)}</p>{items}</div>')
+	return f'<div class="collapse">{"".join(disciplines)}</div>'
+
+
+def city_page(city: str) -> str:
+	seed = sum(map(ord, city))
+	number = lambda n: f"{(seed * 37 + n * 101) % 90000 + 1000:,}"
+	talent = "".join(
+		f'<div id="talentAccordion{i}"><div class="card"><a class="card-link collapsed"><span>{number(i)}</span></a></div>'
+		f'{talent_disciplines(number, i) if i <= 3 else ""}</div>'
+		for i in range(1, 9)
+	)
+	infra = "".join(
+		f'<div id="infraAccordion{i}"><div class="card"><a class="card-link collapsed"><span>Infrastructure {i} of {city}</span></a></div>'
+		f'<div><a><span>Detail {i} of {city}</span></a></div></div>'
+		for i in range(9, 14)
+	)
+	costs = "".join(f"<li><span>{number(20 + i)}</span></li>" for i in range(1, 7))
+	business = "".join(f'<div id="businessAccordion{i}"><span>Business {i} of {city}</span></div>' for i in (11, 12))
+	digital = "".join(f'<div id="digitalAccordion{i}"><span>{number(30 + i)}</span></div>' for i in (11, 13, 14, 15))
+	return (
+		f"<html><head><title>{city} | Digital Cities PH</title></head><body>"
+		f'<header><p class="score">{number(0)}</p></header>'
+		'<ul class="filter-nav"><li>Talent</li><li>Infrastructure</li><li>Business Environment</li><li>Digital Parameters</li></ul>'
+		f'<section><div><div class="details-overall"><p class="score">{number(9)}</p></div></div>{talent}</section>'
+		f"<section>{infra}</section><section><ul>{costs}</ul>{business}</section><section>{digital}</section>"
+		"</body></html>"
+	)
+
+
+def fixture_path(kind: str, url_name: str) -> str:
+	return os.path.join(FIXTURES_DIR, kind, f"{unquote(url_name).lower()}.html")
+
+
+class MockSiteHandler(BaseHTTPRequestHandler):
+	latency = 0.0
+	jitter = 0.0
+
+	def do_GET(self):
+		parts = [part for part in self.path.split("/") if part]
+		if len(parts) != 3 or parts[0] != "location-profiles" or parts[1] not in ("provinces", "cities"):
+			self.send_error(404)
+			return
+		_, kind, url_name = parts
+		time.sleep(self.latency + random.uniform(0, self.jitter))
+		path = fixture_path(kind, url_name)
+		if os.path.exists(path):
+			with open(path, "rb") as f:
+				body = f.read()
+		elif kind == "provinces":
+			body = province_page(display_name(url_name)).encode("utf-8")
+		else:
+			body = city_page(display_name(url_name)).encode("utf-8")
+		self.send_response(200)
+		self.send_header("Content-Type", "text/html; charset=utf-8")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass
+
+
+def start_server(port: int = 0, latency: float = 0.0, jitter: float = 0.0):
+	"""Serve the mock site in a background thread; returns (server, base URL of the location profiles)"""
+	handler = type("Handler", (MockSiteHandler,), {"latency": latency, "jitter": jitter})
+	server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+	server.daemon_threads = True
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return server, f"http://127.0.0.1:{server.server_address[1]}/location-profiles"
+
+
+def record(provinces: list):
+	"""Save the real province pages and their city pages as fixtures (needs network access)"""
+	from modules import http_engine
+	from modules.fields import province_url, city_url
+	for province in provinces:
+		pages = [("provinces", province, province_url(province))]
+		pages += [("cities", city, city_url(city)) for city in http_engine.list_cities(province)]
+		for kind, name, url in pages:
+			response = http_engine.get_session().get(url, timeout=http_engine.HTTP_TIMEOUT)
+			response.raise_for_status()
+			path = fixture_path(kind, name)
+			os.makedirs(os.path.dirname(path), exist_ok=True)
+			with open(path, "wb") as f:
+				f.write(response.content)
+		print(f"Recorded {province} ({len(pages) - 1} cities)")
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--port", type=int, default=8765)
+	parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+	parser.add_argument("--jitter", type=float, default=0.0, help="random extra seconds, up to this much")
+	parser.add_argument("--record", nargs="+", metavar="PROVINCE", help="record these provinces from the real site and exit")
+	args = parser.parse_args()
+	if args.record:
+		record(args.record)
+		return
+	server, base_url = start_server(args.port, args.latency, args.jitter)
+	print(f"Serving mock Digital Cities PH at {base_url}/ (Ctrl+C to stop)")
+	try:
+		threading.Event().wait()
+	except KeyboardInterrupt:
+		server.shutdown()
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,111 @@
+from collections import namedtuple
+import threading
+import logging
+import random
+import json
+import time
+import os
+from modules.city_cache import CACHE_DIR
+from modules.fields import url_name
+
+CHECKPOINT_DIR = os.path.join(CACHE_DIR, "checkpoints")
+# Seconds a finished city in a checkpoint can be resumed from; older cities are scraped again, so a
+# province with a city that keeps failing does not serve the values of its first run forever
+CHECKPOINT_MAX_AGE = 6 * 60 * 60
+
+# A city that could not be extracted: error is the exception type, message its text
+CityFailure = namedtuple("CityFailure", ["province", "city", "attempts", "error", "message"])
+
+
+class RetryPolicy:
+	"""Per-city retries with exponential backoff and jitter
+
+	Args:
+		attempts (int): total attempts per city, including the first one
+		base_delay (float): seconds before the first retry
+		factor (float): delay multiplier for each following retry
+		max_delay (float): upper bound of a single delay
+	"""
+
+	def __init__(self, attempts: int = 3, base_delay: float = 2.0, factor: float = 2.0, max_delay: float = 30.0):
+		self.attempts = max(1, int(attempts))
+		self.base_delay = base_delay
+		self.factor = factor
+		self.max_delay = max_delay
+
+	def delay(self, attempt: int) -> float:
+		"""Seconds to wait after failed attempt number `attempt` (1-based)"""
+		delay = min(self.base_delay * self.factor ** (attempt - 1), self.max_delay)
+		return delay * random.uniform(0.8, 1.2)
+
+
+class Checkpoint:
+	"""Append-only progress file of one province extraction
+
+	Every finished city is appended as one JSON line, either with its values ("done") or with the
+	error that made it fail ("failed"), so an interrupted or partly failed run can resume without
+	scraping completed cities again. The latest line of a city wins; cities finished more than
+	`max_age` seconds ago are no longer resumed.
+
+	Args:
+		province (str): province being extracted
+		mode (str): "simple" or "advanced"
+		directory (str): where checkpoint files are kept
+		max_age (float): seconds a finished city can be resumed from
+	"""
+
+	def __init__(self, province: str, mode: str, directory: str = None, max_age: float = CHECKPOINT_MAX_AGE):
+		self.province = province
+		self.mode = mode
+		self.max_age = max_age
+		directory = directory or CHECKPOINT_DIR
+		os.makedirs(directory, exist_ok=True)
+		self.path = os.path.join(directory, f"{url_name(province).replace('%20', '-')}-{mode}.jsonl")
+		self._lock = threading.Lock()
+
+	def _append(self, record: dict):
+		record["at"] = time.time()
+		with self._lock, open(self.path, "a", encoding="utf-8") as f:
+			f.write(json.dumps(record) + "\n")
+			f.flush()
+
+	def done(self, city_name: str, extract_vars: dict):
+		self._append({"city": city_name, "status": "done", "data": extract_vars})
+
+	def fail(self, city_name: str, attempts: int, error):
+		if isinstance(error, Exception):
+			error_type, message = type(error).__name__, str(error).strip().splitlines()[0] if str(error).strip() else ""
+		else:
+			error_type, message = "Skipped", str(error)
+		self._append({"city": city_name, "status": "failed", "attempts": attempts, "error": error_type, "message": message})
+
+	def _latest(self) -> dict:
+		latest = {}
+		if not os.path.exists(self.path):
+			return latest
+		with self._lock, open(self.path, "r", encoding="utf-8") as f:
+			for line in f:
+				try:
+					record = json.loads(line)
+				except ValueError:
+					# A line cut short by a crash
+					continue
+				latest[record["city"]] = record
+		return latest
+
+	def completed(self) -> dict:
+		"""{city: extract_vars} of every city finished successfully within the last `max_age` seconds"""
+		since = time.time() - self.max_age
+		return {city: record["data"] for city, record in self._latest().items() if record["status"] == "done" and record["at"] >= since}
+
+	def failures(self) -> list:
+		return [
+			CityFailure(self.province, city, record["attempts"], record["error"], record["message"])
+			for city, record in self._latest().items() if record["status"] == "failed"
+		]
+
+	def remove(self):
+		with self._lock:
+			if os.path.exists(self.path):
+				os.remove(self.path)
+				logging.info(f"Checkpoint of {self.province} ({self.mode}) removed")
@@ -0,0 +1,149 @@
+from contextlib import closing
+import threading
+import logging
+import sqlite3
+import json
+import time
+import os
+
+# Persistent per-city cache of extracted profiles, shared by every session and kept across restarts
+
+CACHE_DIR = os.environ.get("DIGICITIESPH_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "digicitiesph"))
+DEFAULT_TTL = 7 * 24 * 60 * 60  # seconds a city profile stays fresh
+DEFAULT_MAX_ENTRIES = 5000  # least recently used city profiles are evicted beyond this
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cities (
+	province TEXT NOT NULL,
+	city TEXT NOT NULL,
+	mode TEXT NOT NULL,
+	data TEXT NOT NULL,
+	fetched_at REAL NOT NULL,
+	accessed_at REAL NOT NULL,
+	PRIMARY KEY (province, city, mode)
+);
+CREATE INDEX IF NOT EXISTS cities_accessed_at ON cities (accessed_at);
+CREATE TABLE IF NOT EXISTS provinces (
+	province TEXT PRIMARY KEY,
+	cities TEXT NOT NULL,
+	fetched_at REAL NOT NULL
+);
+"""
+
+
+class CityCache:
+	"""SQLite cache of city profiles keyed by (province, city, mode)
+
+	Entries older than `ttl` seconds are treated as missing and dropped by `evict()`, which also
+	removes the least recently read entries beyond `max_entries`. The city list of each province is
+	cached with the same TTL.
+
+	Args:
+		path (str): SQLite database file
+		ttl (float): seconds an entry stays fresh
+		max_entries (int): maximum number of city profiles kept
+	"""
+
+	def __init__(self, path: str = None, ttl: float = DEFAULT_TTL, max_entries: int = DEFAULT_MAX_ENTRIES):
+		self.path = path or os.path.join(CACHE_DIR, "cities.sqlite3")
+		self.ttl = ttl
+		self.max_entries = max_entries
+		directory = os.path.dirname(self.path)
+		if directory:
+			os.makedirs(directory, exist_ok=True)
+		with closing(self._connect()) as connection:
+			connection.execute("PRAGMA journal_mode=WAL")
+			connection.executescript(SCHEMA)
+
+	def _connect(self):
+		# One short-lived connection per operation, so the cache can be used from any worker thread
+		return sqlite3.connect(self.path, timeout=30)
+
+	def _fresh_since(self) -> float:
+		return time.time() - self.ttl
+
+	def get_many(self, province: str, cities: list, mode: str) -> dict:
+		"""Fresh cached profiles of `cities` as {city: extract_vars}; stale or missing cities are left out"""
+		if not cities:
+			return {}
+		now = time.time()
+		placeholders = ",".join("?" * len(cities))
+		with closing(self._connect()) as connection, connection:
+			rows = connection.execute(
+				f"SELECT city, data FROM cities WHERE province = ? AND mode = ? AND fetched_at >= ? AND city IN ({placeholders})",
+				[province, mode, self._fresh_since()] + list(cities),
+			).fetchall()
+			connection.execute(
+				f"UPDATE cities SET accessed_at = ? WHERE province = ? AND mode = ? AND city IN ({placeholders})",
+				[now, province, mode] + list(cities),
+			)
+		return {city: json.loads(data) for city, data in rows}
+
+	def get(self, province: str, city: str, mode: str):
+		return self.get_many(province, [city], mode).get(city)
+
+	def put(self, province: str, city: str, mode: str, extract_vars: dict):
+		now = time.time()
+		with closing(self._connect()) as connection, connection:
+			connection.execute(
+				"INSERT OR REPLACE INTO cities (province, city, mode, data, fetched_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+				(province, city, mode, json.dumps(extract_vars), now, now),
+			)
+
+	def entries(self, mode: str) -> list:
+		"""Every fresh cached entry of `mode` as (province, city, extract_vars), by province and city"""
+		with closing(self._connect()) as connection:
+			rows = connection.execute(
+				"SELECT province, city, data FROM cities WHERE mode = ? AND fetched_at >= ? ORDER BY province, city", (mode, self._fresh_since())
+			).fetchall()
+		return [(province, city, json.loads(data)) for province, city, data in rows]
+
+	def get_cities(self, province: str):
+		"""Cached city list of `province`, or None if missing or stale"""
+		with closing(self._connect()) as connection:
+			row = connection.execute(
+				"SELECT cities FROM provinces WHERE province = ? AND fetched_at >= ?", (province, self._fresh_since())
+			).fetchone()
+		return json.loads(row[0]) if row else None
+
+	def put_cities(self, province: str, cities: list):
+		with closing(self._connect()) as connection, connection:
+			connection.execute(
+				"INSERT OR REPLACE INTO provinces (province, cities, fetched_at) VALUES (?, ?, ?)",
+				(province, json.dumps(cities), time.time()),
+			)
+
+	def evict(self) -> int:
+		"""Drop expired entries, then the least recently read ones beyond `max_entries`; returns how many went"""
+		with closing(self._connect()) as connection, connection:
+			expired = connection.execute("DELETE FROM cities WHERE fetched_at < ?", (self._fresh_since(),)).rowcount
+			connection.execute("DELETE FROM provinces WHERE fetched_at < ?", (self._fresh_since(),))
+			overflow = connection.execute(
+				"DELETE FROM cities WHERE rowid IN (SELECT rowid FROM cities ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+				(self.max_entries,),
+			).rowcount
+		if expired or overflow:
+			logging.info(f"City cache: evicted {expired} expired and {overflow} least recently used entries")
+		return expired + overflow
+
+	def __len__(self):
+		with closing(self._connect()) as connection:
+			return connection.execute("SELECT COUNT(*) FROM cities").fetchone()[0]
+
+	def clear(self):
+		with closing(self._connect()) as connection, connection:
+			connection.execute("DELETE FROM cities")
+			connection.execute("DELETE FROM provinces")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_city_cache() -> CityCache:
+	"""Process-wide cache at the default location"""
+	global _cache
+	with _cache_lock:
+		if _cache is None:
+			_cache = CityCache()
+		return _cache
@@ -0,0 +1,266 @@
+"""Headless batch extraction, e.g. from cron
+
+Extracts provinces (all of provinces_list.txt by default) into a dated snapshot directory with one
+export file per province, a summary.json and the run's timings (metrics.json). With --delta each
+province also gets a file of only the values changed since its previous --delta run; --store loads the
+tables into the local data store for cross-province queries.
+
+	python -m modules.cli Batanes Guimaras --engine http --format parquet
+	python -m modules.cli --all --output /data/digicitiesph --cache-dir /var/cache/digicitiesph --quiet
+	python -m modules.cli --all --delta --store --format csv.gz
+
+Exit codes: 0 everything extracted, 1 some cities failed, 3 a province failed, 130 interrupted (Ctrl+C or SIGTERM).
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import datetime
+import logging
+import threading
+import signal
+import json
+import time
+import sys
+import os
+
+EXIT_OK = 0
+EXIT_CITIES_FAILED = 1
+EXIT_PROVINCE_FAILED = 3
+EXIT_INTERRUPTED = 130
+
+DEFAULT_OUTPUT = "snapshots"
+# Provinces extracted at the same time; their cities share the driver pool (or HTTP workers)
+DEFAULT_PARALLEL_PROVINCES = 2
+
+
+def parse_args(argv: list = None):
+	from modules.fields import TALENT_LEVELS
+	parser = argparse.ArgumentParser(prog="python -m modules.cli", description=__doc__.splitlines()[0])
+	parser.add_argument("provinces", nargs="*", help="province names; all of the provinces file when omitted")
+	parser.add_argument("--all", action="store_true", help="every province of the provinces file")
+	parser.add_argument("--provinces-file", help="text file with one province per line (default: provinces_list.txt)")
+	parser.add_argument("--mode", choices=["simple", "advanced"], default="simple")
+	parser.add_argument("--disciplines", nargs="+", choices=list(TALENT_LEVELS), metavar="LEVEL",
+		help=f"talent levels detailed in advanced mode, selenium/http engines (default: all of {', '.join(TALENT_LEVELS)})")
+	parser.add_argument("--engine", choices=["selenium", "http", "crawler"], default="http",
+		help="crawler: one asyncio run over every province (fastest; no city cache or checkpoints)")
+	parser.add_argument("--workers", type=int, default=None, help="parallel browsers per province (selenium/http engines)")
+	parser.add_argument("--parallel-provinces", type=int, default=DEFAULT_PARALLEL_PROVINCES)
+	parser.add_argument("--concurrency", type=int, default=None, help="requests in flight (crawler engine)")
+	parser.add_argument("--retries", type=int, default=None, help="retries of a failed city")
+	parser.add_argument("--skip-errors", action="store_true", help="skip cities whose page does not load instead of retrying")
+	parser.add_argument("--format", dest="filetype", choices=["excel", "csv", "csv.gz", "parquet"], default="csv")
+	parser.add_argument("--output", default=DEFAULT_OUTPUT, help="directory the dated snapshot directory is created in")
+	parser.add_argument("--cache-dir", help="city cache and checkpoint location (default: DIGICITIESPH_CACHE_DIR or ~/.cache/digicitiesph)")
+	parser.add_argument("--no-cache", action="store_true", help="scrape every city even if a fresh copy is cached or checkpointed")
+	parser.add_argument("--delta", action="store_true",
+		help="scrape every city again, save each province's tables as a versioned snapshot and also write the changes since the previous one")
+	parser.add_argument("--store", action="store_true",
+		help="also load each province's tables into the local data store for cross-province queries (modules.data_store)")
+	parser.add_argument("--quiet", action="store_true", help="only print the run summary")
+	return parser.parse_args(argv)
+
+
+def snapshot_directory(output: str) -> str:
+	directory = os.path.join(output, datetime.datetime.now().strftime("%Y%m%d-%H%M%S"))
+	os.makedirs(directory, exist_ok=True)
+	return directory
+
+
+def output_path(directory: str, province: str, filetype: str, suffix: str = "") -> str:
+	from modules.exporters import EXPORT_FORMATS
+	return os.path.join(directory, f"{province} - Digital Cities PH{suffix}.{EXPORT_FORMATS[filetype][0]}")
+
+
+def write_file(path: str, data: bytes):
+	# Write next to the target and rename, so a half-written snapshot is never picked up
+	with open(path + ".part", "wb") as f:
+		f.write(data)
+	os.replace(path + ".part", path)
+
+
+def write_delta(summary: dict, tables: list, failed: list, args, directory: str):
+	"""Record the province's tables as a snapshot and write the changes since the previous one"""
+	from modules.extract import checkpoint_mode
+	from modules.fields import table_names
+	from modules.snapshots import get_snapshot_store, export_delta
+
+	store = get_snapshot_store()
+	snapshot = store.record(summary["province"], checkpoint_mode(args.mode, args.disciplines), tables, table_names(args.mode), failed=failed)
+	changes = store.diff(store.previous(snapshot), snapshot)
+	summary["changes"] = len(changes)
+	summary["delta_file"] = output_path(directory, summary["province"], args.filetype, " changes")
+	write_file(summary["delta_file"], export_delta(changes, args.filetype))
+
+
+def extract_provinces(provinces: list, args, directory: str) -> list:
+	"""Export each province with the selenium or http engine; returns one summary per province"""
+	from modules.extract import export_province, iter_city_rows, failure_report, DEFAULT_WORKERS, DEFAULT_RETRIES
+	from modules.data_store import get_data_store
+	from modules.exporters import export_tables
+	from modules.fields import table_names
+	from modules.tables import build_tables
+
+	def run(province):
+		start = time.time()
+		cities = []
+		summary = {"province": province, "cities": 0, "failed": 0, "seconds": 0.0, "file": None, "error": None}
+		options = dict(
+			workers=args.workers or DEFAULT_WORKERS, engine=args.engine, use_cache=not args.no_cache,
+			retries=DEFAULT_RETRIES if args.retries is None else args.retries, disciplines=args.disciplines, on_listed=cities.extend,
+		)
+		try:
+			if args.delta or args.store:
+				# Snapshots and the data store need the whole tables, so they are built before exporting; a delta
+				# compares freshly scraped values, so every city is scraped again (and the cache updated)
+				rows = iter_city_rows(province, args.mode, args.skip_errors, refresh=args.delta, **options)
+				tables = build_tables(list(rows), args.mode)
+				data = export_tables(tables, args.filetype, table_names(args.mode))
+			else:
+				data = export_province(province, args.mode, args.filetype, args.skip_errors, **options)
+			summary["file"] = output_path(directory, province, args.filetype)
+			write_file(summary["file"], data)
+			failed = failure_report(province, args.mode, args.disciplines)
+			summary["failed"] = len(failed)
+			if args.delta:
+				write_delta(summary, tables, failed["City"].tolist(), args, directory)
+			if args.store:
+				get_data_store().load(province, tables, table_names(args.mode), failed=failed["City"].tolist())
+		except Exception as e:
+			logging.exception(f"{province} failed")
+			summary["error"] = f"{type(e).__name__}: {e}"
+		summary["cities"] = len(cities)
+		summary["seconds"] = time.time() - start
+		return summary
+
+	with ThreadPoolExecutor(max_workers=max(1, args.parallel_provinces), thread_name_prefix="province") as executor:
+		try:
+			return list(executor.map(run, provinces))
+		except KeyboardInterrupt:
+			# Leaving the block would otherwise wait for every queued province to be extracted
+			executor.shutdown(wait=False, cancel_futures=True)
+			raise
+
+
+def crawl_provinces(provinces: list, args, directory: str) -> list:
+	"""Crawl every province in one asyncio run, then export each province; returns one summary per province"""
+	from modules.crawler import crawl, RETRIES, MAX_CONCURRENCY
+	from modules.data_store import get_data_store
+	from modules.exporters import export_tables
+	from modules.fields import table_names
+	from modules.tables import build_tables
+
+	start = time.time()
+	options = {"concurrency": args.concurrency or MAX_CONCURRENCY, "retries": RETRIES if args.retries is None else args.retries}
+	stream = crawl(provinces, args.mode, **options)
+	seconds = time.time() - start
+	rows = {province: [] for province in provinces}
+	for key in sorted(stream.rows):
+		province, city_name, extract_vars = stream.rows[key]
+		rows[province].append((province, city_name, extract_vars))
+	failures = {province: [] for province in provinces}
+	for province, city_name, error in stream.failures:
+		failures[province].append((city_name, error))
+
+	summaries = []
+	for province in provinces:
+		summary = {"province": province, "cities": len(rows[province]) + len(failures[province]), "failed": len(failures[province]),
+			"seconds": seconds, "file": None, "error": None}
+		province_error = [error for city_name, error in failures[province] if city_name is None]
+		if province_error:
+			summary["error"] = province_error[0]
+			summary["cities"] = summary["failed"] = 0
+		else:
+			summary["file"] = output_path(directory, province, args.filetype)
+			tables = build_tables(rows[province], args.mode)
+			write_file(summary["file"], export_tables(tables, args.filetype, table_names(args.mode)))
+			failed = [city_name for city_name, _ in failures[province]]
+			if args.delta:
+				write_delta(summary, tables, failed, args, directory)
+			if args.store:
+				get_data_store().load(province, tables, table_names(args.mode), failed=failed)
+		summaries.append(summary)
+	return summaries
+
+
+def exit_code(summaries: list) -> int:
+	if any(summary["error"] for summary in summaries):
+		return EXIT_PROVINCE_FAILED
+	if any(summary["failed"] for summary in summaries):
+		return EXIT_CITIES_FAILED
+	return EXIT_OK
+
+
+def print_summary(summaries: list, seconds: float, directory: str):
+	print(f"{'Province':<28} {'Cities':>6} {'Failed':>6} {'Seconds':>8}  Result")
+	for summary in summaries:
+		result = summary["error"] or os.path.basename(summary["file"])
+		if summary.get("changes") is not None:
+			result += f" ({summary['changes']} changed values)"
+		print(f"{summary['province']:<28} {summary['cities']:>6} {summary['failed']:>6} {summary['seconds']:>8.1f}  {result}")
+	cities = sum(summary["cities"] for summary in summaries)
+	failed = sum(summary["failed"] for summary in summaries)
+	print(f"{len(summaries)} provinces, {cities} cities ({failed} failed) in {seconds:.1f} seconds"
+		f" ({cities / seconds if seconds else 0.0:.1f} cities/s) -> {directory}")
+
+
+def interrupt(signum, frame):
+	raise KeyboardInterrupt
+
+
+def main(argv: list = None) -> int:
+	args = parse_args(argv)
+	# The cache location is read when the cache module is imported, so it is set before importing the extractor
+	if args.cache_dir:
+		os.environ["DIGICITIESPH_CACHE_DIR"] = args.cache_dir
+	from modules.crawler import load_provinces, PROVINCES_FILE
+	from modules.metrics import metrics
+	if args.quiet:
+		logging.disable(logging.WARNING)
+
+	provinces = args.provinces
+	if args.all or not provinces:
+		provinces = load_provinces(args.provinces_file or PROVINCES_FILE)
+	directory = snapshot_directory(args.output)
+	# Stopped by cron, systemd or docker: exit like on Ctrl+C
+	if threading.current_thread() is threading.main_thread():
+		signal.signal(signal.SIGTERM, interrupt)
+
+	start = time.time()
+	try:
+		if args.engine == "crawler":
+			summaries = crawl_provinces(provinces, args, directory)
+		else:
+			summaries = extract_provinces(provinces, args, directory)
+	except KeyboardInterrupt:
+		from modules.driver_pool import close_all_pools
+		print("Interrupted; finished cities are checkpointed and resume on the next run", file=sys.stderr)
+		# Cities still being scraped fail at once instead of keeping Chrome open
+		close_all_pools()
+		return EXIT_INTERRUPTED
+	seconds = time.time() - start
+
+	code = exit_code(summaries)
+	with open(os.path.join(directory, "summary.json"), "w") as f:
+		json.dump({
+			"started": datetime.datetime.fromtimestamp(start).isoformat(timespec="seconds"),
+			"seconds": seconds,
+			"mode": args.mode,
+			"engine": args.engine,
+			"format": args.filetype,
+			"exit_code": code,
+			"provinces": summaries,
+		}, f, indent=2)
+	with open(os.path.join(directory, "metrics.json"), "w") as f:
+		f.write(metrics.to_json(indent=2))
+	print_summary(summaries, seconds, directory)
+	return code
+
+
+if __name__ == "__main__":
+	code = main()
+	if code == EXIT_INTERRUPTED:
+		# Do not wait for the provinces still running; their finished cities are checkpointed already
+		sys.stdout.flush()
+		sys.stderr.flush()
+		os._exit(code)
+	sys.exit(code)
@@ -0,0 +1,173 @@
+from lxml import etree
+import aiohttp
+import asyncio
+import logging
+import random
+import time
+import os
+from modules.fields import province_url, city_url
+from modules.http_engine import HEADERS, HTTP_TIMEOUT, IncompleteProfile, parse_document, parse_city, parse_province
+from modules.tables import build_tables
+from modules.metrics import metrics
+
+# Whole-country extraction: discover the cities of many provinces and fetch them all in one asyncio run,
+# using the browserless parser of `http_engine`.
+
+PROVINCES_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "provinces_list.txt")
+
+MAX_CONCURRENCY = 32
+PER_HOST_CONCURRENCY = 8
+REQUESTS_PER_SECOND = 10.0
+RETRIES = 3
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Errors recorded as a failure of one city (or province) instead of aborting the crawl
+CRAWL_ERRORS = (IncompleteProfile, aiohttp.ClientError, asyncio.TimeoutError, etree.LxmlError)
+
+
+def load_provinces(path: str = PROVINCES_FILE) -> list:
+	with open(path, 'r') as f:
+		return [line for line in f.read().splitlines() if line.strip()]
+
+
+class RateLimiter:
+	"""Spaces request starts at least 1/rate seconds apart across all tasks (rate 0 disables it)"""
+
+	def __init__(self, rate: float):
+		self.interval = 1.0 / rate if rate else 0.0
+		self._next = 0.0
+		self._lock = None
+
+	async def wait(self):
+		if not self.interval:
+			return
+		if self._lock is None:
+			self._lock = asyncio.Lock()
+		async with self._lock:
+			now = time.monotonic()
+			delay = self._next - now
+			self._next = max(now, self._next) + self.interval
+		if delay > 0:
+			await asyncio.sleep(delay)
+
+
+class TableStream:
+	"""The tables, filled row by row as cities arrive
+
+	Rows are kept in province list order, then province page order, whatever order they arrive in.
+	Cities that could not be crawled are listed in `failures` as (province, city, error); city is None
+	when the province page itself failed.
+	"""
+
+	def __init__(self, mode: str):
+		self.mode = mode
+		self.rows = {}
+		self.failures = []
+
+	def add(self, key: tuple, province: str, city_name: str, extract_vars: dict):
+		self.rows[key] = (province, city_name, extract_vars)
+
+	def __len__(self):
+		return len(self.rows)
+
+	def tables(self) -> list:
+		"""Talent, infra, business and digital DataFrames (plus talent details in Advanced mode) of the rows received so far"""
+		return build_tables([self.rows[key] for key in sorted(self.rows)], self.mode)
+
+
+class Crawler:
+	"""Asyncio crawler for many provinces with bounded concurrency, rate limiting and retries
+
+	Args:
+		mode (str): "simple" or "advanced"
+		concurrency (int): requests in flight at once, across all hosts
+		per_host (int): connections to the same host at once
+		rate (float): request starts per second (0 for unlimited)
+		retries (int): retries of a request on connection errors, timeouts and 429/5xx responses
+	"""
+
+	def __init__(self, mode: str = "simple", concurrency: int = MAX_CONCURRENCY, per_host: int = PER_HOST_CONCURRENCY,
+			rate: float = REQUESTS_PER_SECOND, retries: int = RETRIES):
+		self.mode = mode
+		self.concurrency = concurrency
+		self.per_host = per_host
+		self.limiter = RateLimiter(rate)
+		self.retries = retries
+		self._semaphore = None
+
+	async def fetch(self, session, url: str):
+		for attempt in range(self.retries + 1):
+			await self.limiter.wait()
+			try:
+				async with self._semaphore:
+					async with session.get(url) as response:
+						response.raise_for_status()
+						content = await response.read()
+				return parse_document(content)
+			except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+				retryable = not isinstance(e, aiohttp.ClientResponseError) or e.status in RETRY_STATUSES
+				if not retryable or attempt == self.retries:
+					raise
+				delay = 2 ** attempt * 0.5 + random.uniform(0, 0.5)
+				logging.info(f"{url} failed ({e!r}), retry {attempt + 1}/{self.retries} in {delay:.1f}s")
+				await asyncio.sleep(delay)
+
+	async def crawl_city(self, session, key: tuple, province: str, city_name: str, stream: TableStream, on_row):
+		start = time.perf_counter()
+		try:
+			tree = await self.fetch(session, city_url(city_name))
+			# Parsing does not await, so the thread's metric labels belong to this city only
+			with metrics.labels(province, city_name):
+				extract_vars = parse_city(tree, city_name, self.mode)
+		except CRAWL_ERRORS as e:
+			logging.info(f"{province} / {city_name} failed: {e!r}")
+			stream.failures.append((province, city_name, repr(e)))
+			metrics.record("city", time.perf_counter() - start, False, province=province, city=city_name)
+			return
+		metrics.record("city", time.perf_counter() - start, province=province, city=city_name)
+		stream.add(key, province, city_name, extract_vars)
+		if on_row is not None:
+			on_row(province, city_name, extract_vars)
+
+	async def crawl_province(self, session, index: int, province: str, stream: TableStream, on_row):
+		try:
+			city_names = parse_province(await self.fetch(session, province_url(province)), province)
+		except CRAWL_ERRORS as e:
+			logging.info(f"{province} failed: {e!r}")
+			stream.failures.append((province, None, repr(e)))
+			return
+		logging.info(f"{province}: {len(city_names)} cities found")
+		await asyncio.gather(*(
+			self.crawl_city(session, (index, n), province, city_name, stream, on_row)
+			for n, city_name in enumerate(city_names)
+		))
+
+	async def run(self, provinces: list, on_row=None, stream: TableStream = None) -> TableStream:
+		"""Crawl `provinces`, calling `on_row(province, city, extract_vars)` as each city arrives"""
+		stream = stream if stream is not None else TableStream(self.mode)
+		self._semaphore = asyncio.Semaphore(self.concurrency)
+		start_time = time.time()
+		connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host)
+		timeout = aiohttp.ClientTimeout(total=HTTP_TIMEOUT)
+		async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=HEADERS) as session:
+			await asyncio.gather(*(
+				self.crawl_province(session, index, province, stream, on_row)
+				for index, province in enumerate(provinces)
+			))
+		logging.info(f"Crawled {len(stream)} cities of {len(provinces)} provinces ({len(stream.failures)} failures) in {time.time() - start_time} seconds")
+		return stream
+
+
+def crawl(provinces: list = None, mode: str = "simple", on_row=None, **options) -> TableStream:
+	"""Crawl the given provinces (all of provinces_list.txt by default) in one bounded run
+
+	Args:
+		provinces (list): province names; None for the whole country
+		mode (str): "simple" or "advanced"
+		on_row (callable): called with (province, city, extract_vars) as each city arrives
+		**options: `Crawler` limits (concurrency, per_host, rate, retries)
+
+	Returns:
+		TableStream: `.tables()` gives the DataFrames, `.failures` what could not be crawled
+	"""
+	return asyncio.run(Crawler(mode, **options).run(provinces or load_provinces(), on_row))
@@ -0,0 +1,258 @@
+from contextlib import closing
+import threading
+import logging
+import sqlite3
+import time
+import os
+import re
+import pandas as pd
+from modules.city_cache import CACHE_DIR
+from modules.exporters import python_value
+from modules.fields import NUMERIC_COLUMNS, POPULATION, TABLE_NAMES, TALENT_DETAILS_TABLE, TALENT_DETAIL_COLUMNS, table_columns
+from modules.tables import KEY_COLUMNS
+
+# Local analytical store of the latest extraction of every province: one SQLite table per extracted
+# table (same names and columns), so cities can be filtered, ranked and aggregated across provinces
+# without scraping again or reading export files.
+
+DEFAULT_RANK_LIMIT = 20
+
+LOADS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS loads (
+	province TEXT NOT NULL,
+	table_name TEXT NOT NULL,
+	cities INTEGER NOT NULL,
+	loaded_at REAL NOT NULL,
+	PRIMARY KEY (province, table_name)
+);
+"""
+
+NUMBER = re.compile(r"-?\d[\d,]*(?:\.\d+)?")
+
+
+def number(text):
+	"""First number in a value ("1,234 Mbps" -> 1234.0, "PHP 420.50" -> 420.5), None without one"""
+	if text is None or isinstance(text, (int, float)):
+		return text
+	match = NUMBER.search(str(text))
+	return float(match.group().replace(",", "")) if match else None
+
+
+def quote(name: str) -> str:
+	"""SQL identifier of a table or column name (they contain spaces and parentheses)"""
+	return '"' + name.replace('"', '""') + '"'
+
+
+def store_columns() -> dict:
+	"""{table name: [(column, SQL type), ...]} of the store, Simple and Advanced mode columns alike"""
+	numeric = set(NUMERIC_COLUMNS) | {"Graduates"}
+	schema = {}
+	for name, columns in zip(TABLE_NAMES, table_columns("advanced")):
+		schema[name] = [(column, "TEXT") for column in KEY_COLUMNS] + [
+			(column, "NUMERIC" if column in numeric else "TEXT") for column in [POPULATION.column] + columns
+		]
+	schema[TALENT_DETAILS_TABLE] = [(column, "TEXT") for column in KEY_COLUMNS] + [
+		(column, "NUMERIC" if column in numeric else "TEXT") for column in TALENT_DETAIL_COLUMNS
+	]
+	return schema
+
+
+def schema_script() -> str:
+	statements = [LOADS_SCHEMA]
+	for name, columns in store_columns().items():
+		definitions = [f"{quote(column)} {kind}" for column, kind in columns]
+		if name != TALENT_DETAILS_TABLE:
+			definitions.append("PRIMARY KEY (Province, City)")
+		statements.append(f"CREATE TABLE IF NOT EXISTS {quote(name)} ({', '.join(definitions)});")
+		index = name.lower().replace(" ", "_")
+		if name == TALENT_DETAILS_TABLE:
+			statements.append(f"CREATE INDEX IF NOT EXISTS {index}_province_city ON {quote(name)} (Province, City);")
+			statements.append(f"CREATE INDEX IF NOT EXISTS {index}_level_field ON {quote(name)} (Level, Field);")
+		statements.append(f"CREATE INDEX IF NOT EXISTS {index}_city ON {quote(name)} (City);")
+	return "\n".join(statements)
+
+
+class DataStore:
+	"""SQLite store of extracted tables, replaced province by province as extractions finish
+
+	Table and column names are the ones of the exports (e.g. `SELECT City, "Internet Bandwidth" FROM
+	"Infrastructure"`). Counts and the minimum wage are stored as numbers, the other values as scraped;
+	`number(text)` is available in SQL to read the leading number of a text value ("1,234 beds" -> 1234.0).
+	Rows are keyed by (Province, City) and indexed by city.
+
+	Args:
+		path (str): SQLite database file
+	"""
+
+	def __init__(self, path: str = None):
+		self.path = path or os.path.join(CACHE_DIR, "data.sqlite3")
+		self.schema = store_columns()
+		directory = os.path.dirname(self.path)
+		if directory:
+			os.makedirs(directory, exist_ok=True)
+		with closing(self._connect()) as connection:
+			connection.execute("PRAGMA journal_mode=WAL")
+			connection.executescript(schema_script())
+
+	def _connect(self, read_only: bool = False):
+		if read_only:
+			connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=30)
+		else:
+			connection = sqlite3.connect(self.path, timeout=30)
+		connection.create_function("number", 1, number, deterministic=True)
+		return connection
+
+	def load(self, province: str, tables: list, names: list, failed: list = ()) -> int:
+		"""Replace the rows of `province` with the tables of its latest extraction; returns the rows written
+
+		Tables missing from `names` (e.g. the talent details after a Simple extraction) keep their rows.
+		Cities in `failed` keep the values of their previous extraction.
+		"""
+		failed = set(failed)
+		written = 0
+		now = time.time()
+		with closing(self._connect()) as connection, connection:
+			for name, table in zip(names, tables):
+				if name not in self.schema:
+					continue
+				columns = [column for column, _ in self.schema[name] if column in table.columns]
+				table = table[~table["City"].isin(failed)]
+				cities = table["City"].unique().tolist()
+				# Talent details of a run of only some levels replace just those levels
+				levels = table["Level"].unique().tolist() if name == TALENT_DETAILS_TABLE else []
+				level_filter = f" AND Level IN ({','.join('?' * len(levels))})" if levels else ""
+				for start in range(0, len(cities), 500):
+					batch = cities[start:start + 500]
+					connection.execute(
+						f"DELETE FROM {quote(name)} WHERE Province = ? AND City IN ({','.join('?' * len(batch))}){level_filter}",
+						[province] + batch + levels,
+					)
+				connection.executemany(
+					f"INSERT OR REPLACE INTO {quote(name)} ({', '.join(quote(column) for column in columns)}) VALUES ({', '.join('?' * len(columns))})",
+					[[python_value(value) for value in row] for row in table[columns].itertuples(index=False)],
+				)
+				connection.execute(
+					"INSERT OR REPLACE INTO loads (province, table_name, cities, loaded_at) VALUES (?, ?, ?, ?)",
+					(province, name, len(cities), now),
+				)
+				written += len(table)
+		logging.info(f"Data store: loaded {written} rows of {province}")
+		return written
+
+	def load_city_cache(self, cache) -> int:
+		"""Load every fresh profile (and talent details) of the city cache, e.g. after a restart; returns the rows written"""
+		# Imported here, so querying the store does not load the extractor
+		from modules.extract import PROFILE_CACHE_KEY, talent_cache_key
+		from modules.fields import TALENT_LEVELS, TALENT_DETAILS
+		from modules.tables import build_tables
+
+		rows = {}
+		for province, city_name, extract_vars in cache.entries(PROFILE_CACHE_KEY):
+			rows.setdefault(province, {})[city_name] = dict(extract_vars)
+		for level in TALENT_LEVELS:
+			for province, city_name, details in cache.entries(talent_cache_key(level)):
+				if city_name in rows.get(province, {}):
+					rows[province][city_name].setdefault(TALENT_DETAILS, {})[level] = details
+		written = 0
+		for province, cities in rows.items():
+			province_rows = [(province, city_name, extract_vars) for city_name, extract_vars in cities.items()]
+			names = TABLE_NAMES + [TALENT_DETAILS_TABLE]
+			tables = build_tables(province_rows, "advanced")
+			if not any(TALENT_DETAILS in extract_vars for extract_vars in cities.values()):
+				# Simple profiles only: keep talent details loaded from an earlier Advanced extraction
+				names, tables = names[:-1], tables[:-1]
+			written += self.load(province, tables, names)
+		return written
+
+	def query(self, sql: str, params=()) -> pd.DataFrame:
+		"""Run a read-only SQL query, e.g. `store.query('SELECT * FROM "Talent" WHERE Province = ?', ["Cebu"])`"""
+		with closing(self._connect(read_only=True)) as connection:
+			return pd.read_sql_query(sql, connection, params=list(params))
+
+	def table_of(self, column: str) -> str:
+		"""First table holding `column` (Population is in all four; Graduates in the talent details)"""
+		for name, columns in self.schema.items():
+			if any(name_ == column for name_, _ in columns):
+				return name
+		raise KeyError(f"Unknown column: {column}")
+
+	def value_columns(self) -> list:
+		"""Every column that can be ranked or aggregated, in table order"""
+		columns = []
+		for name, definitions in self.schema.items():
+			key = KEY_COLUMNS if name != TALENT_DETAILS_TABLE else KEY_COLUMNS + TALENT_DETAIL_COLUMNS[:-1]
+			columns.extend(column for column, _ in definitions if column not in key and column not in columns)
+		return columns
+
+	def _sort_key(self, name: str, column: str) -> str:
+		kind = dict(self.schema[name])[column]
+		# Text values ("100 Mbps") are ordered by their leading number
+		return quote(column) if kind == "NUMERIC" else f"number({quote(column)})"
+
+	def _province_filter(self, provinces: list) -> tuple:
+		if not provinces:
+			return "", []
+		return f" AND Province IN ({','.join('?' * len(provinces))})", list(provinces)
+
+	def rank(self, column: str, ascending: bool = False, limit: int = DEFAULT_RANK_LIMIT, provinces: list = None) -> pd.DataFrame:
+		"""Cities ranked by `column` across all (or the given) provinces, e.g. `rank("Internet Bandwidth")`
+		or `rank("(Cost) Monthly Office Space Rental per sqm", ascending=True)`; cities without a value are left out
+		"""
+		name = self.table_of(column)
+		key = self._sort_key(name, column)
+		where, params = self._province_filter(provinces)
+		table = self.query(
+			f"SELECT Province, City, {quote(column)} FROM {quote(name)} WHERE {key} IS NOT NULL{where} "
+			f"ORDER BY {key} {'ASC' if ascending else 'DESC'}, Province, City LIMIT ?",
+			params + [int(limit)],
+		)
+		table.insert(0, "Rank", range(1, len(table) + 1))
+		return table
+
+	def aggregate(self, column: str, by="Province", provinces: list = None) -> pd.DataFrame:
+		"""Count, min, average, max and sum of `column` per group, largest average first
+
+		Args:
+			by (str or list): grouping columns of the column's table, e.g. "Province", or ["Level", "Field"] for Graduates
+		"""
+		name = self.table_of(column)
+		by = [by] if isinstance(by, str) else list(by)
+		columns = dict(self.schema[name])
+		unknown = [group for group in by if group not in columns]
+		if unknown:
+			raise KeyError(f"{name} has no column {', '.join(unknown)}")
+		key = self._sort_key(name, column)
+		groups = ", ".join(quote(group) for group in by)
+		where, params = self._province_filter(provinces)
+		return self.query(
+			f"SELECT {groups}, COUNT({key}) AS count, MIN({key}) AS min, AVG({key}) AS avg, MAX({key}) AS max, SUM({key}) AS sum "
+			f"FROM {quote(name)} WHERE 1{where} GROUP BY {groups} ORDER BY avg DESC",
+			params,
+		)
+
+	def provinces(self) -> pd.DataFrame:
+		"""Loaded provinces with their number of cities and when they were last loaded"""
+		table = self.query(
+			"SELECT province AS Province, MAX(cities) AS Cities, MAX(loaded_at) AS \"Loaded at\" FROM loads GROUP BY province ORDER BY province"
+		)
+		table["Loaded at"] = pd.to_datetime(table["Loaded at"], unit="s")
+		return table
+
+	def clear(self):
+		with closing(self._connect()) as connection, connection:
+			for name in self.schema:
+				connection.execute(f"DELETE FROM {quote(name)}")
+			connection.execute("DELETE FROM loads")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_data_store() -> DataStore:
+	"""Process-wide data store at the default location"""
+	global _store
+	with _store_lock:
+		if _store is None:
+			_store = DataStore()
+		return _store
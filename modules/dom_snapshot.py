@@ -0,0 +1,108 @@
+from modules.metrics import metrics
+from modules.fields import TALENT_BODY, TALENT_SHOWN, TALENT_DISCIPLINE, TALENT_SPECIALIZATION, TALENT_NAME, TALENT_GRADUATES
+
+# Evaluates a list of [column, by, selector] specs inside the page and returns {column: text or null}
+# as `values`, with the lookup time of each field in milliseconds as `timings`.
+# textContent is read so values in tabs that are not open yet are still found; whitespace is
+# normalized the same way as the http engine's `element_text`.
+SNAPSHOT_SCRIPT = """
+const values = {};
+const timings = {};
+for (const [column, by, selector] of arguments[0]) {
+	const start = performance.now();
+	let element = null;
+	if (by === "xpath") {
+		element = document.evaluate(selector, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+	} else {
+		element = document.querySelector(selector);
+	}
+	values[column] = element === null ? null : element.textContent.replace(/\\s+/g, " ").trim();
+	timings[column] = performance.now() - start;
+}
+return {values: values, timings: timings};
+"""
+
+CITY_NAMES_SCRIPT = """
+return Array.from(document.querySelectorAll(".municipality"), (municipality) => {
+	const heading = municipality.querySelector("h6");
+	return heading === null ? null : heading.textContent.replace(/\\s+/g, " ").trim();
+});
+"""
+
+# Reads the disciplines of one talent accordion as [[field, specialization or null, graduates], ...];
+# null when the accordion has no body yet (it has never been expanded)
+TALENT_DETAILS_SCRIPT = """
+const [accordion, body, shown, discipline, specialization, name, graduates] = arguments;
+const container = document.querySelector(accordion + " " + body);
+if (container === null) {
+	return null;
+}
+const text = (parent, selector) => {
+	const element = parent.querySelector(selector);
+	return element === null ? null : element.textContent.replace(/\\s+/g, " ").trim();
+};
+const rows = [];
+for (const field of container.querySelectorAll(discipline)) {
+	const specializations = field.querySelectorAll(specialization);
+	if (specializations.length === 0) {
+		rows.push([text(field, name), null, text(field, graduates)]);
+	}
+	for (const item of specializations) {
+		rows.push([text(field, name), text(item, name), text(item, graduates)]);
+	}
+}
+// An empty collapsed body may only be filled once expanded
+if (rows.length === 0 && !container.classList.contains(shown)) {
+	return null;
+}
+return rows;
+"""
+
+
+def city_names(driver) -> list:
+	"""Headings of every `.municipality` on a province page in one round trip (None where a heading is missing)"""
+	return driver.execute_script(CITY_NAMES_SCRIPT)
+
+
+def snapshot(driver, fields: list) -> dict:
+	"""Raw text of every field in one `execute_script` round trip; None for fields not in the DOM
+
+	The in-page lookup time of each field is recorded as metrics span "field <column>".
+	"""
+	with metrics.span("snapshot"):
+		result = driver.execute_script(SNAPSHOT_SCRIPT, [[field.column, field.by, field.selector] for field in fields])
+	for column, milliseconds in result["timings"].items():
+		metrics.record(f"field {column}", milliseconds / 1000)
+	return result["values"]
+
+
+def talent_details(driver, accordion: str):
+	"""Disciplines of the talent accordion `accordion` in one round trip; None if its body is missing, or empty and not expanded"""
+	with metrics.span("talent details"):
+		return driver.execute_script(
+			TALENT_DETAILS_SCRIPT, accordion, TALENT_BODY, TALENT_SHOWN, TALENT_DISCIPLINE, TALENT_SPECIALIZATION, TALENT_NAME, TALENT_GRADUATES
+		)
+
+
+class RoundTripCounter:
+	"""Counts the WebDriver commands (browser round trips) a driver sends inside the `with` block
+
+	Every driver and element command goes through `driver.execute`, which is wrapped for the block.
+	"""
+
+	def __init__(self, driver):
+		self.driver = driver
+		self.count = 0
+
+	def __enter__(self):
+		execute = self.driver.execute
+
+		def counting_execute(*args, **kwargs):
+			self.count += 1
+			return execute(*args, **kwargs)
+
+		self.driver.execute = counting_execute
+		return self
+
+	def __exit__(self, *exc):
+		del self.driver.execute
@@ -0,0 +1,397 @@
+from contextlib import contextmanager
+import threading
+import logging
+import weakref
+import atexit
+import signal
+import queue
+import os
+
+# A driver is restarted after this many borrowings (about one city page each), since Chrome's memory
+# only grows over a long province
+MAX_DRIVER_PAGES = 50
+# ... or as soon as its process tree (chromedriver, browser, renderers) uses more than this
+MAX_DRIVER_RSS_MB = 700
+# Memory all drivers of the process may use together, across every pool and Streamlit session; above it
+# a borrower waits for a driver to be returned instead of starting another browser
+CHROME_MEMORY_BUDGET_MB = float(os.environ.get("DIGICITIESPH_CHROME_MEMORY_MB", 2048))
+# Memory assumed for a browser that is starting while no other driver has been measured yet
+DRIVER_RSS_ESTIMATE_MB = 250
+# Seconds between budget checks while waiting for a driver
+BUDGET_WAIT_SECONDS = 1.0
+
+MB = 1024 * 1024
+
+
+def driver_pid(driver):
+	"""Process id of the driver's chromedriver, None for drivers without a local service"""
+	process = getattr(getattr(driver, "service", None), "process", None)
+	return getattr(process, "pid", None)
+
+
+def process_tree(pid: int) -> list:
+	"""`pid` and all of its descendants, from psutil or /proc; [] when the process is gone"""
+	try:
+		import psutil
+	except ImportError:
+		psutil = None
+	if psutil is not None:
+		try:
+			parent = psutil.Process(pid)
+			return [pid] + [child.pid for child in parent.children(recursive=True)]
+		except psutil.Error:
+			return []
+	children = {}
+	try:
+		entries = [entry for entry in os.listdir("/proc") if entry.isdigit()]
+	except OSError:
+		return []
+	for entry in entries:
+		try:
+			with open(f"/proc/{entry}/stat") as f:
+				# The command name may contain spaces; fields after it are space separated
+				ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+		except (OSError, IndexError, ValueError):
+			continue
+		children.setdefault(ppid, []).append(int(entry))
+	if not os.path.exists(f"/proc/{pid}"):
+		return []
+	tree, pending = [], [pid]
+	while pending:
+		current = pending.pop()
+		tree.append(current)
+		pending.extend(children.get(current, []))
+	return tree
+
+
+def process_rss(pid: int):
+	"""Resident memory in bytes of a single process, None if unknown"""
+	try:
+		import psutil
+		try:
+			return psutil.Process(pid).memory_info().rss
+		except psutil.Error:
+			return None
+	except ImportError:
+		pass
+	try:
+		with open(f"/proc/{pid}/statm") as f:
+			return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+	except (OSError, IndexError, ValueError):
+		return None
+
+
+def driver_rss(driver):
+	"""Resident memory in bytes of the driver's whole process tree, None where it cannot be measured"""
+	pid = driver_pid(driver)
+	if pid is None:
+		return None
+	sizes = [process_rss(process) for process in process_tree(pid)]
+	sizes = [size for size in sizes if size is not None]
+	return sum(sizes) if sizes else None
+
+
+def kill_process_tree(pids: list):
+	"""Last resort when `quit()` fails: kill the browser processes it left behind"""
+	for pid in reversed(pids):
+		try:
+			os.kill(pid, signal.SIGKILL)
+		except (OSError, AttributeError):
+			pass
+
+
+class DriverPool:
+	"""Bounded pool of reusable WebDrivers.
+
+	At most `size` drivers are alive at any time. Drivers are handed out with `driver()` and put back
+	after use so the next city (or province) does not pay Chrome start-up again. A driver that stops
+	responding is quit and dropped, and the next caller gets a fresh one from `factory`.
+
+	Drivers are recycled (quit and replaced on the next borrowing) after `max_pages` borrowings or once
+	their processes use more than `max_rss_mb`. A new driver is only started while all drivers of the
+	process stay within CHROME_MEMORY_BUDGET_MB; otherwise the borrower waits for one to be returned.
+	`resize()` changes `size` in place, so runs already using the pool keep going.
+
+	Args:
+		factory (callable): creates a new WebDriver, e.g. `use_driver`
+		size (int): maximum number of concurrent drivers
+		max_pages (int): borrowings before a driver is restarted
+		max_rss_mb (float): memory of one driver's processes before it is restarted
+	"""
+
+	def __init__(self, factory, size: int = 4, max_pages: int = MAX_DRIVER_PAGES, max_rss_mb: float = MAX_DRIVER_RSS_MB):
+		self.factory = factory
+		self.size = max(1, int(size))
+		self.max_pages = max_pages
+		self.max_rss_mb = max_rss_mb
+		self._idle = queue.LifoQueue()
+		# Borrowed drivers, at most `size`; the condition is notified when a slot frees up or the pool grows
+		self._slots = threading.Condition()
+		self._in_use = 0
+		self._lock = threading.Lock()
+		# Live drivers with their borrowings and last measured memory (bytes, None if unknown)
+		self._live = {}
+		self._closed = False
+		_all_pools.add(self)
+
+	def _acquire_slot(self, blocking: bool = True) -> bool:
+		with self._slots:
+			if not blocking and self._in_use >= self.size:
+				return False
+			while self._in_use >= self.size:
+				self._slots.wait()
+			self._in_use += 1
+			return True
+
+	def _release_slot(self):
+		with self._slots:
+			self._in_use -= 1
+			self._slots.notify()
+
+	def resize(self, size: int):
+		"""Change the number of concurrent drivers; extra drivers are quit once they are idle"""
+		size = max(1, int(size))
+		with self._slots:
+			if size == self.size:
+				return
+			logging.info(f"Driver pool: resized from {self.size} to {size} drivers")
+			self.size = size
+			self._slots.notify_all()
+		while len(self._live) > self.size and self.trim():
+			pass
+
+	def _create(self):
+		driver = self.factory()
+		# Measured right away, so browsers started at the same time count against the budget
+		rss = driver_rss(driver)
+		with self._lock:
+			self._live[driver] = {"pages": 0, "rss": rss}
+		logging.info(f"Driver pool: started driver ({len(self._live)}/{self.size})")
+		return driver
+
+	def usage(self) -> list:
+		"""Borrowings and memory (bytes, as last measured) of each live driver"""
+		with self._lock:
+			return [dict(usage) for usage in self._live.values()]
+
+	def stats(self) -> dict:
+		with self._lock:
+			return {
+				"drivers": len(self._live),
+				"idle": self._idle.qsize(),
+				"size": self.size,
+				"pages": sum(usage["pages"] for usage in self._live.values()),
+				"memory_mb": sum(usage["rss"] or 0 for usage in self._live.values()) / MB,
+			}
+
+	def _over_budget(self) -> bool:
+		# Whether one more driver would not fit; called with _budget_lock held. Idle drivers of other pools
+		# (e.g. another worker count) give their memory back first
+		while chrome_memory(starting=1) / MB > CHROME_MEMORY_BUDGET_MB:
+			if not any(pool.trim() for pool in list(_all_pools) if pool is not self):
+				# With no driver of its own a pool may always start one, so it cannot wait forever
+				return bool(self._live) or self in _starting
+		return False
+
+	def _create_within_budget(self):
+		"""A new driver, or None if the memory budget is used up"""
+		with _budget_lock:
+			if self._over_budget():
+				return None
+			# Counted against the budget until it can be measured
+			_starting.append(self)
+		try:
+			return self._create()
+		finally:
+			with _budget_lock:
+				_starting.remove(self)
+
+	def _acquire_driver(self):
+		"""An idle driver, a new one within the memory budget, or the next one returned by another borrower"""
+		while True:
+			try:
+				return self._idle.get_nowait()
+			except queue.Empty:
+				pass
+			driver = self._create_within_budget()
+			if driver is not None:
+				return driver
+			logging.info(f"Driver pool: Chrome memory budget of {CHROME_MEMORY_BUDGET_MB:.0f} MB reached, waiting for a driver")
+			try:
+				return self._idle.get(timeout=BUDGET_WAIT_SECONDS)
+			except queue.Empty:
+				# A returned driver may have been recycled instead, freeing memory for a new one
+				continue
+
+	def _needs_recycling(self, driver) -> bool:
+		"""Count a borrowing and measure the driver; True if it has served its pages or grew too large"""
+		rss = driver_rss(driver)
+		with self._lock:
+			usage = self._live.get(driver)
+			if usage is None:
+				return False
+			usage["pages"] += 1
+			usage["rss"] = rss
+			pages = usage["pages"]
+		if self.max_pages and pages >= self.max_pages:
+			logging.info(f"Driver pool: recycling driver after {pages} pages")
+			return True
+		if rss is not None and self.max_rss_mb and rss / MB > self.max_rss_mb:
+			logging.info(f"Driver pool: recycling driver using {rss / MB:.0f} MB (limit {self.max_rss_mb:.0f} MB)")
+			return True
+		return False
+
+	@staticmethod
+	def is_alive(driver) -> bool:
+		try:
+			driver.current_url
+			return True
+		except Exception:
+			return False
+
+	def discard(self, driver):
+		"""Quit a driver and forget it, so its slot is refilled on the next acquisition."""
+		with self._lock:
+			self._live.pop(driver, None)
+		pid = driver_pid(driver)
+		pids = process_tree(pid) if pid is not None else []
+		try:
+			driver.quit()
+		except Exception:
+			# A browser that does not answer any more still holds its memory
+			kill_process_tree(pids)
+		logging.info(f"Driver pool: discarded driver ({len(self._live)}/{self.size} left)")
+
+	@contextmanager
+	def driver(self, discard_on_error: bool = False):
+		"""Borrow a driver for the duration of the `with` block.
+
+		A driver that stopped responding is always replaced; with `discard_on_error` any exception in the
+		block restarts it, so a retry starts from a fresh browser.
+		"""
+		if self._closed:
+			raise RuntimeError("Driver pool is closed")
+		self._acquire_slot()
+		driver = None
+		try:
+			driver = self._acquire_driver()
+			yield driver
+		except BaseException:
+			# Also on KeyboardInterrupt or a generator closed mid-city: the driver is never left behind
+			if driver is not None and (discard_on_error or not self.is_alive(driver)):
+				self.discard(driver)
+				driver = None
+			raise
+		finally:
+			if driver is not None:
+				if self._closed or self._needs_recycling(driver) or len(self._live) > self.size:
+					self.discard(driver)
+				else:
+					self._idle.put(driver)
+			self._release_slot()
+
+	def warm(self, count: int = 1):
+		"""Start up to `count` drivers in a background thread and keep them idle for the first callers."""
+		def start():
+			for _ in range(count):
+				# Holding a slot while Chrome starts keeps the pool within `size` drivers
+				if self._closed or len(self._live) >= self.size or not self._acquire_slot(blocking=False):
+					return
+				try:
+					driver = self._create_within_budget()
+					if driver is None:
+						return
+					self._idle.put(driver)
+				except Exception as e:
+					logging.info(f"Driver pool: warm-up failed ({e!r})")
+					return
+				finally:
+					self._release_slot()
+
+		threading.Thread(target=start, name="driver-pool-warmup", daemon=True).start()
+
+	def run(self, fn, item, retries: int = 1, discard_on_error: bool = False):
+		"""Call `fn(driver, item)` with a pooled driver, retrying on a fresh driver if the one used crashed."""
+		for attempt in range(retries + 1):
+			crashed = False
+			try:
+				with self.driver(discard_on_error=discard_on_error) as driver:
+					try:
+						return fn(driver, item)
+					except Exception:
+						crashed = not self.is_alive(driver)
+						raise
+			except Exception:
+				if crashed and attempt < retries:
+					logging.info(f"Driver pool: driver crashed on {item}, retrying with a new driver")
+					continue
+				raise
+
+	def trim(self) -> bool:
+		"""Quit one idle driver to free its memory; False if none is idle"""
+		try:
+			driver = self._idle.get_nowait()
+		except queue.Empty:
+			return False
+		self.discard(driver)
+		return True
+
+	def close(self, force: bool = False):
+		"""Quit every idle driver; drivers still in use are quit when they are returned, or right away with `force`."""
+		self._closed = True
+		while self.trim():
+			pass
+		if force:
+			with self._lock:
+				drivers = list(self._live)
+			for driver in drivers:
+				self.discard(driver)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+# Every pool of the process, for the memory budget and for quitting all drivers at exit
+_all_pools = weakref.WeakSet()
+
+
+# Drivers being started (one entry per start-up, the pool starting it); guarded by _budget_lock
+_starting = []
+_budget_lock = threading.Lock()
+
+
+def chrome_memory(starting: int = 0) -> int:
+	"""Memory in bytes of all pooled drivers of the process, with drivers still starting up (plus `starting` more)
+	counted at the average size
+	"""
+	sizes = [usage["rss"] for pool in list(_all_pools) for usage in pool.usage() if usage["rss"] is not None]
+	average = sum(sizes) / len(sizes) if sizes else DRIVER_RSS_ESTIMATE_MB * MB
+	return sum(sizes) + (len(_starting) + starting) * average
+
+
+def pool_stats() -> list:
+	"""Drivers, idle drivers, pages served and memory of each pool, e.g. for diagnostics"""
+	return [dict(pool.stats(), factory=getattr(pool.factory, "__name__", str(pool.factory))) for pool in list(_all_pools) if pool._live]
+
+
+def get_driver_pool(factory, size: int = 4) -> DriverPool:
+	"""Process-wide pool for `factory`, shared across cities, provinces, Streamlit sessions and reruns.
+
+	Asking for a different size resizes the pool in place: runs already using it (e.g. another session's
+	job) keep their drivers, and idle drivers such as the warmed-up one are kept.
+	"""
+	with _pools_lock:
+		pool = _pools.get(factory)
+		if pool is None or pool._closed:
+			pool = _pools[factory] = DriverPool(factory, size)
+		else:
+			pool.resize(size)
+		return pool
+
+
+@atexit.register
+def close_all_pools():
+	"""Quit every driver of the process, including drivers still in use, so no Chrome outlives it"""
+	with _pools_lock:
+		for pool in list(_all_pools):
+			pool.close(force=True)
+		_pools.clear()
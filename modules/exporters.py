@@ -0,0 +1,171 @@
+import pandas as pd
+import zipfile
+import shutil
+import gzip
+import io
+from modules.fields import TABLE_NAMES, column_dtype
+
+# Streaming exports of the tables (plus the talent details in Advanced mode). Rows are written as they
+# arrive (`write`), compressed or encoded in memory, and `close()` returns the finished file as bytes
+# ready for `st.download_button`; nothing is written to disk.
+
+# filetype: (file extension, MIME type)
+EXPORT_FORMATS = {
+	"excel": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+	"csv": ("zip", "application/zip"),
+	"csv.gz": ("zip", "application/zip"),
+	"parquet": ("zip", "application/zip"),
+}
+
+
+def python_value(value):
+	"""Cell value as a plain Python object, None for missing values"""
+	if pd.isna(value):
+		return None
+	return value.item() if hasattr(value, "item") else value
+
+
+class TableExporter:
+	"""Base class: `write(tables)` appends rows to each table, `close()` returns the file bytes
+
+	Args:
+		names (list): table names, in the order tables are written (file or worksheet names)
+	"""
+
+	filetype = None
+
+	def __init__(self, names: list = TABLE_NAMES):
+		self.names = list(names)
+
+	def write(self, tables: list):
+		for index, table in enumerate(tables):
+			self.write_table(index, table)
+
+	def write_table(self, index: int, table: pd.DataFrame):
+		raise NotImplementedError
+
+	def close(self) -> bytes:
+		raise NotImplementedError
+
+
+class CsvExporter(TableExporter):
+	"""One CSV per table in a zip file
+
+	Each table is kept gzip-compressed in memory while rows arrive. `gzipped` stores the `.csv.gz`
+	files in the zip as they are; otherwise they are decompressed into deflated `.csv` entries.
+	"""
+
+	def __init__(self, gzipped: bool = False, names: list = TABLE_NAMES):
+		super().__init__(names)
+		self.filetype = "csv.gz" if gzipped else "csv"
+		self.gzipped = gzipped
+		self.buffers = [io.BytesIO() for _ in self.names]
+		self.streams = [gzip.GzipFile(fileobj=buffer, mode="wb") for buffer in self.buffers]
+		self.header_written = [False for _ in self.names]
+
+	def write_table(self, index: int, table: pd.DataFrame):
+		text = table.to_csv(index=False, header=not self.header_written[index])
+		self.streams[index].write(text.encode("utf-8"))
+		self.header_written[index] = True
+
+	def close(self) -> bytes:
+		for stream in self.streams:
+			stream.close()
+		output = io.BytesIO()
+		with zipfile.ZipFile(output, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+			for name, buffer in zip(self.names, self.buffers):
+				buffer.seek(0)
+				if self.gzipped:
+					zip_file.writestr(f"{name}.csv.gz", buffer.getvalue(), compress_type=zipfile.ZIP_STORED)
+				else:
+					with zip_file.open(f"{name}.csv", "w") as entry, gzip.GzipFile(fileobj=buffer, mode="rb") as source:
+						shutil.copyfileobj(source, entry)
+		return output.getvalue()
+
+
+class ParquetExporter(TableExporter):
+	"""One Parquet file per table in a zip file; every `write` becomes a row group
+
+	Each file's schema comes from the column dtypes of `column_dtype`, so every chunk has the same types.
+	"""
+
+	filetype = "parquet"
+
+	def __init__(self, names: list = TABLE_NAMES):
+		super().__init__(names)
+		import pyarrow
+		import pyarrow.parquet
+		self.pa = pyarrow
+		self.pq = pyarrow.parquet
+		self.buffers = [io.BytesIO() for _ in self.names]
+		self.writers = [None for _ in self.names]
+
+	def schema(self, table: pd.DataFrame):
+		"""Arrow schema of a table from the fixed column dtypes (`column_dtype`), not from the rows of its first chunk"""
+		types = {"Int64": self.pa.int64(), "Float64": self.pa.float64(), "string": self.pa.string()}
+		return self.pa.schema([(column, types[column_dtype(column)]) for column in table.columns])
+
+	def write_table(self, index: int, table: pd.DataFrame):
+		writer = self.writers[index]
+		if writer is None:
+			writer = self.writers[index] = self.pq.ParquetWriter(self.buffers[index], self.schema(table))
+		if table.empty:
+			return
+		# Safe casts only: a value that does not fit its column type fails the export instead of being altered
+		writer.write_table(self.pa.Table.from_pandas(table, schema=writer.schema, preserve_index=False))
+
+	def close(self) -> bytes:
+		output = io.BytesIO()
+		with zipfile.ZipFile(output, "w") as zip_file:
+			for name, buffer, writer in zip(self.names, self.buffers, self.writers):
+				if writer is None:
+					continue
+				writer.close()
+				# Parquet is already compressed
+				zip_file.writestr(f"{name}.parquet", buffer.getvalue(), compress_type=zipfile.ZIP_STORED)
+		return output.getvalue()
+
+
+class ExcelExporter(TableExporter):
+	"""One worksheet per table in a single `.xlsx`, built in memory row by row"""
+
+	filetype = "excel"
+
+	def __init__(self, names: list = TABLE_NAMES):
+		super().__init__(names)
+		import xlsxwriter
+		self.buffer = io.BytesIO()
+		self.workbook = xlsxwriter.Workbook(self.buffer, {"in_memory": True, "nan_inf_to_errors": True})
+		self.worksheets = [self.workbook.add_worksheet(name) for name in self.names]
+		self.next_row = [0 for _ in self.names]
+
+	def write_table(self, index: int, table: pd.DataFrame):
+		worksheet = self.worksheets[index]
+		if self.next_row[index] == 0:
+			worksheet.write_row(0, 0, list(table.columns))
+			self.next_row[index] = 1
+		for row in table.itertuples(index=False):
+			worksheet.write_row(self.next_row[index], 0, [python_value(value) for value in row])
+			self.next_row[index] += 1
+
+	def close(self) -> bytes:
+		self.workbook.close()
+		return self.buffer.getvalue()
+
+
+def open_exporter(filetype: str, names: list = TABLE_NAMES) -> TableExporter:
+	filetype = filetype.lower()
+	if filetype == "excel":
+		return ExcelExporter(names)
+	if filetype in ("csv", "csv.gz"):
+		return CsvExporter(gzipped=filetype == "csv.gz", names=names)
+	if filetype == "parquet":
+		return ParquetExporter(names)
+	raise ValueError(f"Unknown export file type: {filetype} (expected one of {', '.join(EXPORT_FORMATS)})")
+
+
+def export_tables(tables: list, filetype: str, names: list = TABLE_NAMES) -> bytes:
+	"""Export complete tables in one go"""
+	exporter = open_exporter(filetype, names)
+	exporter.write(tables)
+	return exporter.close()
@@ -1,22 +1,59 @@
-from selenium import webdriver 
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service as ChromeService 
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException
-from chromedriver_py import binary_path
-import streamlit as st
+from selenium.common.exceptions import TimeoutException, NoSuchElementException
 import pandas as pd
+import threading
 import logging
-import zipfile
-import io
 import time
-import requests
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+from modules.driver_pool import get_driver_pool
+from modules.city_cache import get_city_cache
+from modules.checkpoint import Checkpoint, CityFailure, RetryPolicy
+from modules.tables import build_tables
+from modules.metrics import metrics
+from modules.exporters import EXPORT_FORMATS, open_exporter
+from modules.dom_snapshot import RoundTripCounter, snapshot, city_names, talent_details
+from modules.fields import POPULATION, TABLE_NAMES, TALENT_LEVELS, TALENT_DETAILS, fields_for, talent_levels, table_names, clean_value, province_url, city_url, url_name
+from modules.readiness import PageBudget, CITY_PAGE_BUDGET, PROVINCE_PAGE_BUDGET, wait_for_title, wait_for_score, wait_for_municipalities, open_tab, open_accordion
 
 logging.basicConfig(level=logging.INFO)
 
+# Number of headless Chrome drivers scraping cities at the same time
+DEFAULT_WORKERS = 4
+# "selenium": headless Chrome per city; "http": fetch and parse pages without a browser, Selenium per city as fallback
+ENGINES = ["selenium", "http"]
+DEFAULT_ENGINE = "selenium"
+# Concurrent HTTP requests of the "http" engine
+HTTP_WORKERS = 16
+# Cities written to an export file at a time
+EXPORT_CHUNK_ROWS = 8
+# Retries of a failed city (each on a restarted browser) before it goes into the failure report
+DEFAULT_RETRIES = 2
+
+# Chrome profile settings: the extractor only reads text, so images, notifications and popups are turned off
+CHROME_PREFS = {
+	"profile.managed_default_content_settings.images": 2,
+	"profile.default_content_setting_values.notifications": 2,
+	"profile.default_content_setting_values.geolocation": 2,
+	"profile.default_content_setting_values.popups": 2,
+	"profile.default_content_setting_values.media_stream": 2,
+}
+# Requests the browser never makes: images, web fonts, media and analytics. Stylesheets are still
+# loaded, because the readiness waits check whether tabs and accordions are visible.
+BLOCKED_URLS = [
+	"*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico",
+	"*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+	"*.mp4", "*.webm", "*.mp3",
+	"*fonts.googleapis.com*", "*fonts.gstatic.com*",
+	"*google-analytics.com*", "*googletagmanager.com*", "*facebook.net*",
+]
+
 def use_driver():
+	# Selenium's WebDriver modules are only imported once a browser is needed
+	from selenium import webdriver
+	from selenium.webdriver.chrome.options import Options
+	from selenium.webdriver.chrome.service import Service as ChromeService
+	from chromedriver_py import binary_path
+
 	## Setup chrome options
 	chrome_options = Options()
 	chrome_options.add_argument("--headless=new") # Ensure GUI is off
@@ -24,264 +61,381 @@ def use_driver():
 	chrome_options.add_argument('--disable-gpu')
 	chrome_options.add_argument('--ignore-ssl-errors=yes')
 	chrome_options.add_argument('--ignore-certificate-errors')
+	chrome_options.add_argument('--blink-settings=imagesEnabled=false')
+	chrome_options.add_argument('--disable-extensions')
+	chrome_options.add_argument('--disable-background-networking')
+	chrome_options.add_argument('--disable-default-apps')
+	chrome_options.add_argument('--disable-sync')
+	chrome_options.add_argument('--mute-audio')
+	chrome_options.add_argument('--no-first-run')
+	chrome_options.add_experimental_option("prefs", CHROME_PREFS)
+	# Return after DOMContentLoaded; the readiness waits decide when the values are there
+	chrome_options.page_load_strategy = "eager"
 	
-	driver = webdriver.Chrome(service=ChromeService(executable_path=binary_path), options=chrome_options) 
+	with metrics.span("driver startup"):
+		driver = webdriver.Chrome(service=ChromeService(executable_path=binary_path), options=chrome_options) 
+		driver.execute_cdp_cmd("Network.enable", {})
+		driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URLS})
 	
 	return driver
 
-def scrape_each_city(city_name: str, driver, mode: str, dfs: list, columns: list, skip_error: bool):
-	"""_summary_
+def warm_up(workers: int = DEFAULT_WORKERS):
+	"""Start a headless browser in the background, so the first preview does not wait for Chrome start-up"""
+	get_driver_pool(use_driver, workers).warm()
+
+def extract_city(city_name: str, driver, mode: str, skip_error: bool, levels: list = (), profile: bool = True):
+	"""Scrape one city profile page into a flat dict of column name to value
 
 	Args:
-		city_name_URL (str): city name in URL format (lowercase, spaces replaced with %20)
+		city_name (str): city name as listed on the province page
 		driver (_type_): WebDriver
 		mode (str): "simple" or "advanced"
-		dfs (list): DataFrame list, in correct order: talent, infra, business, digital
+		skip_error (bool): return None instead of failing when the page does not load
+		levels (list): talent levels (keys of TALENT_LEVELS) whose details are read; their accordions are only
+			expanded when the disciplines are not in the page yet
+		profile (bool): read the profile fields; False when only talent details are needed
+
+	Returns:
+		dict: extracted values keyed by column name (including "Population"), plus TALENT_DETAILS
+			({level: [[field, specialization, graduates], ...]}) for `levels`; None if skipped
 	"""
 	
-	print(city_name, " is being scraped")
 	logging.info(f"{city_name} is being scraped")
 	start_time = time.time()
 	selected_mode = mode.lower()
-	talent_df = dfs[0]
-	infra_df = dfs[1]
-	business_df = dfs[2]
-	digital_df = dfs[3]
-	talent_columns = columns[0]
-	infra_columns = columns[1]
-	business_columns = columns[2]
-	digital_columns = columns[3]
- 
-	city_name_URL = city_name.split()
-	city_name_URL = [word.lower() for word in city_name_URL]
-	city_name_URL = '%20'.join(city_name_URL)
-	driver.get(f'http://www.digitalcitiesph.com/location-profiles/cities/{city_name_URL}/')
-	driver.implicitly_wait(10)
-	time.sleep(10)
-	try:
-		w = WebDriverWait(driver, 30)
-		w.until(EC.title_contains(f"{city_name}"))
-		# w.until(EC.element_to_be_clickable((By.CSS_SELECTOR, ".filter-nav > li:nth-child(1)")))
-		logging.info(f"{city_name} Page load happened")
-	except TimeoutException:
-		if skip_error:
-			logging.info(f"{city_name} skipped! Timeout happened no page load ({driver.title}) ({driver.current_url})")
-			return talent_df, infra_df, business_df, digital_df
-		else:
-			logging.info(f"{city_name} error! Timeout happened no page load ({driver.title}) ({driver.current_url})")
-	assert city_name in driver.title, f"Expected {city_name} in {driver.title}"
-	logging.info(f"Driver redirected to: (Title: {driver.title}) http://www.digitalcitiesph.com/location-profiles/cities/{city_name_URL}/")
-	#  obtain population by XPATH
-	logging.info(f"Obtaining population data for {city_name}")
-	#  Add population
-	city_population = driver.find_elements(By.CLASS_NAME, 'score')[0].text.replace(',', '')
-	time.sleep(1)
-	talent_df.loc[talent_df["City"] == city_name, "Population"] = city_population
-	infra_df.loc[infra_df["City"] == city_name, "Population"] = city_population
-	business_df.loc[business_df["City"] == city_name, "Population"] = city_population
-	digital_df.loc[digital_df["City"] == city_name, "Population"] = city_population
-	
-	#  imitate clicking of navbar to set menu active and show info according to menu
-	extract_vars = {}
  
-	#  Talent table
-	logging.info(f"Obtaining Talent data for {city_name}")
-	if selected_mode == "simple":
-		WebDriverWait(driver, 30).until(EC.element_to_be_clickable((By.CSS_SELECTOR, ".filter-nav > li:nth-child(1)")))
-		driver.find_element(By.CSS_SELECTOR, ".filter-nav > li:nth-child(1)").click()
-		extract_vars["Total Graduates"] = driver.find_element(By.CSS_SELECTOR, "div:nth-child(1) > .details-overall > .score").text.replace(',', '')
-		extract_vars["Higher Education Graduates"] = driver.find_element(By.CSS_SELECTOR, "#talentAccordion1 > .card > .card-link > span").text.replace(',', '')
-		extract_vars["Technical Vocational Graduates"] = driver.find_element(By.CSS_SELECTOR, "#talentAccordion2 .collapsed > span").text.replace(',', '')
-		extract_vars["Senior High Graduates"] = driver.find_element(By.CSS_SELECTOR, "#talentAccordion3 > .card > .collapsed > span").text.replace(',', '')
-		extract_vars["Number of Center of Excellence"] = driver.find_element(By.CSS_SELECTOR, "#talentAccordion4 span").text.replace(',', '')
-		extract_vars["Number of Center of Development"] = driver.find_element(By.CSS_SELECTOR, "#talentAccordion5 span").text.replace(',', '')
-		extract_vars["Number of Higher Education Institutions"] = driver.find_element(By.CSS_SELECTOR, "#talentAccordion6 span").text.replace(',', '')
-		extract_vars["Number of Technical Vocational Institutions"] = driver.find_element(By.CSS_SELECTOR, "#talentAccordion7 span").text.replace(',', '')
-		extract_vars["Number of Schools offering Senior High"] = driver.find_element(By.CSS_SELECTOR, "#talentAccordion8 span").text.replace(',', '')
-	elif selected_mode == "advanced":
-		# Graduates of courses and other disciplines
-		pass
-
-	#  Infrastructure table
-	logging.info(f"Obtaining Infrastructure data for {city_name}")
-	WebDriverWait(driver, 30).until(EC.element_to_be_clickable((By.CSS_SELECTOR, ".filter-nav > li:nth-child(2)")))
-	driver.find_element(By.CSS_SELECTOR, ".filter-nav > li:nth-child(2)").click()
-	extract_vars["Office Real Estate"] = driver.find_element(By.CSS_SELECTOR, "#infraAccordion9 .card-link > span").text
-	extract_vars["Telco Infrastructure"] = driver.find_element(By.CSS_SELECTOR, "#infraAccordion10 span").text
-	extract_vars["Internet Bandwidth"] = driver.find_element(By.CSS_SELECTOR, "#infraAccordion11 .collapsed > span").text
-	extract_vars["Power Supply"] = driver.find_element(By.CSS_SELECTOR, "#infraAccordion12 .collapsed > span").text
-	extract_vars["Transportation Access"] = driver.find_element(By.XPATH, "//div[@id=\'infraAccordion13\']/div/a/span").text
-	extract_vars["Hotel Availability"] = driver.find_element(By.XPATH, "(//div[@id=\'infraAccordion11\']/div/a/span)[2]").text
-	extract_vars["Hospital Beds"] = driver.find_element(By.XPATH, "(//div[@id=\'infraAccordion12\']/div/a/span)[2]").text
-	extract_vars["Recreational and Tourist Attractions"] = driver.find_element(By.XPATH, "(//div[@id=\'infraAccordion13\']/div/a/span)[2]").text
-
-	#  Business Environment table
-	logging.info(f"Obtaining Business Environment data for {city_name}")
-	WebDriverWait(driver, 30).until(EC.element_to_be_clickable((By.CSS_SELECTOR, ".filter-nav > li:nth-child(3)")))
-	driver.find_element(By.CSS_SELECTOR, ".filter-nav > li:nth-child(3)").click()
-	extract_vars["(Cost) Minimum Wage Nonagri"] = driver.find_element(By.CSS_SELECTOR, "li:nth-child(1) > span").text.replace(',', '')
-	extract_vars["(Cost) Monthly Office Space Rental per sqm"] = driver.find_element(By.CSS_SELECTOR, "li:nth-child(2) > span").text
-	extract_vars["(Cost) Grade A"] = driver.find_element(By.CSS_SELECTOR, "li:nth-child(3) > span").text
-	extract_vars["(Cost) Grade B"] = driver.find_element(By.CSS_SELECTOR, "li:nth-child(4) > span").text
-	extract_vars["(Cost) Grade C"] = driver.find_element(By.CSS_SELECTOR, "li:nth-child(5) > span").text
-	extract_vars["(Cost) Monthly Power Rates"] = driver.find_element(By.CSS_SELECTOR, "li:nth-child(6) > span").text
-	extract_vars["PEZA IT Parks/Centers"] = driver.find_element(By.CSS_SELECTOR, ".collapsed > span").text
-	extract_vars["Disaster Preparedness Plan"] = driver.find_element(By.CSS_SELECTOR, "#businessAccordion11 span").text
-	extract_vars["Average Crime Solution Efficiency"] = driver.find_element(By.CSS_SELECTOR, "#businessAccordion12 span").text
-
-	#  Digital Parameters table
-	logging.info(f"Obtaining Digital Parameters data for {city_name}")
-	WebDriverWait(driver, 30).until(EC.element_to_be_clickable((By.CSS_SELECTOR, ".filter-nav > li:nth-child(4)")))
-	driver.find_element(By.CSS_SELECTOR, ".filter-nav > li:nth-child(4)").click()
-	extract_vars["Open Innovation Ecosystem"] = driver.find_element(By.CSS_SELECTOR, "#digitalAccordion11 span").text
-	extract_vars["Number of Startups"] = driver.find_element(By.CSS_SELECTOR, "#digitalAccordion13 span").text
-	extract_vars["Innovation Policy and Incentives"] = driver.find_element(By.CSS_SELECTOR, "#digitalAccordion14 span").text
-	extract_vars["Number of Unicorns"] = driver.find_element(By.CSS_SELECTOR, "#digitalAccordion15 span").text
-
-	#  Add scraped data to dataframe using a loop of columns' keys and values
-	for i in talent_columns:
-		talent_df.loc[talent_df["City"] == city_name, i] = extract_vars[i]
-	for i in infra_columns:
-		infra_df.loc[infra_df["City"] == city_name, i] = extract_vars[i]
-	for i in business_columns:
-		business_df.loc[business_df["City"] == city_name, i] = extract_vars[i]
-	for i in digital_columns:
-		digital_df.loc[digital_df["City"] == city_name, i] = extract_vars[i]
+	url = city_url(city_name)
+	budget = PageBudget(city_name, CITY_PAGE_BUDGET)
+	with RoundTripCounter(driver) as counter:
+		with metrics.span("navigation"):
+			driver.get(url)
+		try:
+			wait_for_title(driver, city_name, budget)
+			logging.info(f"{city_name} Page load happened")
+		except TimeoutException:
+			if skip_error:
+				logging.info(f"{city_name} skipped! Timeout happened no page load ({driver.title}) ({driver.current_url})")
+				return None
+			else:
+				logging.info(f"{city_name} error! Timeout happened no page load ({driver.title}) ({driver.current_url})")
+		assert city_name in driver.title, f"Expected {city_name} in {driver.title}"
+		logging.info(f"Driver redirected to: (Title: {driver.title}) {url}")
+		#  population is the first value rendered; once it is there, read every field in one script call
+		wait_for_score(driver, budget)
+		fields = [POPULATION] + fields_for(selected_mode) if profile else []
+		values = snapshot(driver, fields) if fields else {}
 
-	end_time = time.time()
-	print(f"{city_name} took {end_time - start_time} seconds to scrape")
-	logging.info(f"{city_name} took {end_time - start_time} seconds to scrape")
+		#  imitate clicking of navbar only for tabs whose content is rendered lazily, then read that tab again
+		lazy_tabs = sorted({field.tab for field in fields if field.tab is not None and not values.get(field.column)})
+		for tab in lazy_tabs:
+			logging.info(f"Obtaining {TABLE_NAMES[tab - 1]} data for {city_name} (lazy tab)")
+			open_tab(driver, tab, budget)
+			values.update(snapshot(driver, [field for field in fields if field.tab == tab]))
+
+		#  expand only the requested talent accordions whose disciplines are not rendered (see TALENT_SHOWN)
+		details = {level: talent_details(driver, TALENT_LEVELS[level]) for level in levels}
+		collapsed = [level for level in levels if details[level] is None]
+		if collapsed and 1 not in lazy_tabs:
+			open_tab(driver, 1, budget)
+		for level in collapsed:
+			logging.info(f"Obtaining {level} graduates of {city_name} (expanding accordion)")
+			open_accordion(driver, TALENT_LEVELS[level], budget)
+			details[level] = talent_details(driver, TALENT_LEVELS[level])
 
-	return talent_df, infra_df, business_df, digital_df
+	extract_vars = {}
+	for field in fields:
+		if values.get(field.column) is None:
+			raise NoSuchElementException(f"{city_name}: no element for {field.column} ({field.selector})")
+		extract_vars[field.column] = clean_value(field, values[field.column])
+	if levels:
+		for level in levels:
+			if details[level] is None:
+				raise NoSuchElementException(f"{city_name}: no {level} disciplines ({TALENT_LEVELS[level]})")
+		extract_vars[TALENT_DETAILS] = details
 
-@st.cache_data()
-def preview(selected_province, mode, skip_error: bool):
-	logging.info(f"Preview started {'(Skipping errors)' if skip_error else ''}")
-	driver = use_driver()
+	end_time = time.time()
+	logging.info(f"{city_name} took {end_time - start_time} seconds to scrape ({counter.count} WebDriver round trips, {len(lazy_tabs)} tab clicks, {len(collapsed)} accordion clicks)")
 
-	# province_name for URL use
-	province_name = selected_province.split()
-	province_name = [word.lower() for word in province_name]
-	province_name = '%20'.join(province_name)
+	return extract_vars
 
-	url = f'http://www.digitalcitiesph.com/location-profiles/provinces/{province_name}/'
+def list_cities(selected_province: str, driver):
+	"""Open the province page and return the city/municipality names listed on it"""
+	url = province_url(selected_province)
 
-	driver.get(url)
-	driver.implicitly_wait(10) 
-	time.sleep(10)
+	budget = PageBudget(selected_province, PROVINCE_PAGE_BUDGET)
+	with metrics.span("navigation"):
+		driver.get(url)
 	logging.info(f"Driver redirected to: {url}")
-	logging.info(f"Page title: {driver.title}")
 	
 	try:
-		w = WebDriverWait(driver, 8)
-		w.until(EC.title_contains(f"{selected_province}"))
-		# w.until(EC.presence_of_element_located((By.CLASS_NAME, 'municipality')))
-		logging.info("Page load happened")
+		wait_for_title(driver, selected_province, budget)
+		wait_for_municipalities(driver, budget)
+		logging.info(f"Page load happened (Page title: {driver.title})")
 	except TimeoutException:
 		logging.info("Timeout happened no page load")
 	
 	assert selected_province in driver.title, f"Expected {selected_province} in {driver.title}"
-	# print(driver.title.split()[2:])
-	preview_test = driver.title
-	preview_test += "\n"
 
-	elements = driver.find_elements(By.CLASS_NAME, 'municipality') 
-	# make a dataframe with province name and city names
-	# df = pd.DataFrame(columns=['province', 'city'])
- 
-	# TALENT TABLE
-	talent_df = pd.DataFrame([], columns=['Province', 'City', 'Population'])
-	# INFRASTRUCTURE TABLE
-	infra_df = pd.DataFrame([], columns=['Province', 'City', 'Population'])
-	# BUSINESS ENVIRONMENT TABLE
-	business_df = pd.DataFrame([], columns=['Province', 'City', 'Population'])
-	# DIGITAL PARAMETERS TABLE
-	digital_df = pd.DataFrame([], columns=['Province', 'City', 'Population'])
-	
+	# Each heading is named after the city
+	names = city_names(driver)
+	if None in names:
+		raise NoSuchElementException(f"{selected_province}: municipality without a heading")
+	return names
+
+def city_names_of(selected_province: str, pool, engine: str, cache=None, refresh: bool = False):
+	if cache is not None and not refresh:
+		cached = cache.get_cities(selected_province)
+		if cached is not None:
+			logging.info(f"{selected_province} city list from cache")
+			return cached
+	city_names = fetch_city_names(selected_province, pool, engine)
+	if cache is not None:
+		cache.put_cities(selected_province, city_names)
+	return city_names
+
+def fetch_city_names(selected_province: str, pool, engine: str):
+	if engine == "http":
+		from modules import http_engine
+		try:
+			return http_engine.list_cities(selected_province)
+		except http_engine.HTTP_ERRORS as e:
+			logging.info(f"{selected_province} HTTP city listing failed ({e}), falling back to Selenium")
+	with pool.driver() as driver:
+		return list_cities(selected_province, driver)
+
+def city_scraper(pool, mode: str, skip_error: bool, engine: str):
+	"""Function that scrapes one city with `engine`, falling back to a pooled Selenium driver
+
+	The function takes the city name, the talent levels to read and whether to read the profile fields.
+	"""
+	def selenium_city(city_name, levels=(), profile=True):
+		# A failed city restarts its browser, so the retry policy retries it on a fresh one
+		return pool.run(lambda driver, city: extract_city(city, driver, mode, skip_error=skip_error, levels=levels, profile=profile), city_name, discard_on_error=True)
+
+	def http_city(city_name, levels=(), profile=True):
+		# requests and lxml are only imported once the http engine is used
+		from modules import http_engine
+		try:
+			return http_engine.extract_city(city_name, mode, levels=levels, profile=profile)
+		except http_engine.HTTP_ERRORS as e:
+			logging.info(f"{city_name} HTTP extraction failed ({e}), falling back to Selenium")
+			return selenium_city(city_name, levels, profile)
+
+	scrape_city = http_city if engine == "http" else selenium_city
+
+	def timed_city(city_name, levels=(), profile=True):
+		with metrics.span("city"):
+			return scrape_city(city_name, levels, profile)
+
+	return timed_city
+
+# City cache entries: the profile fields (the same in both modes) and the details of each talent level
+PROFILE_CACHE_KEY = "profile"
+
+def talent_cache_key(level: str) -> str:
+	return f"talent {level}"
+
+def cached_scraper(scrape_city, cache, selected_province: str, cities: list, levels: list = (), refresh: bool = False, on_cached=None):
+	"""Wrap `scrape_city` so fresh cached cities are not scraped again and new results are saved
+
+	The profile and each talent level are cached on their own, so a city only scrapes what is missing:
+	Advanced after Simple only reads the talent details, and one more level only expands that accordion.
+	With `refresh` every city is scraped again and the cache updated. `on_cached` is called with the name of
+	each city whose profile came from the cache.
+	"""
+	cached = {} if refresh else cache.get_many(selected_province, cities, PROFILE_CACHE_KEY)
+	cached_details = {level: {} if refresh else cache.get_many(selected_province, cities, talent_cache_key(level)) for level in levels}
+	complete = sum(city in cached and all(city in cached_details[level] for level in levels) for city in cities)
+	logging.info(f"{complete}/{len(cities)} cities of {selected_province} are cached, scraping {len(cities) - complete}")
+
+	def scrape_or_cached(city_name):
+		profile = cached.get(city_name)
+		details = {level: cached_details[level][city_name] for level in levels if city_name in cached_details[level]}
+		missing = [level for level in levels if level not in details]
+		if profile is not None and on_cached is not None:
+			on_cached(city_name)
+		if profile is None or missing:
+			extract_vars = scrape_city(city_name, missing, profile is None)
+			if extract_vars is None:
+				return None
+			scraped_details = extract_vars.pop(TALENT_DETAILS, {})
+			if profile is None:
+				profile = extract_vars
+				cache.put(selected_province, city_name, PROFILE_CACHE_KEY, profile)
+			for level in missing:
+				details[level] = scraped_details[level]
+				cache.put(selected_province, city_name, talent_cache_key(level), details[level])
+		if not levels:
+			return profile
+		return dict(profile, **{TALENT_DETAILS: {level: details[level] for level in levels}})
+
+	return scrape_or_cached
+
+def resumable_scraper(scrape_city, checkpoint, policy, resume: bool = True):
+	"""Wrap `scrape_city` with the per-city retry policy and checkpointing
+
+	With `resume`, cities completed in a recent run are taken from the checkpoint. A city that still fails
+	after every attempt, or is skipped, is recorded in the checkpoint as a failure and returns None.
+	"""
+	completed = checkpoint.completed() if resume else {}
+	if completed:
+		logging.info(f"Resuming {checkpoint.province} from checkpoint: {len(completed)} cities already done")
+
+	def scrape_with_retries(city_name):
+		if city_name in completed:
+			return completed[city_name]
+		with metrics.labels(checkpoint.province, city_name):
+			return scrape_city_with_retries(city_name)
+
+	def scrape_city_with_retries(city_name):
+		for attempt in range(1, policy.attempts + 1):
+			try:
+				extract_vars = scrape_city(city_name)
+			except Exception as e:
+				if attempt == policy.attempts:
+					logging.info(f"{city_name} failed after {attempt} attempt(s): {e!r}")
+					checkpoint.fail(city_name, attempt, e)
+					return None
+				delay = policy.delay(attempt)
+				logging.info(f"{city_name} failed ({e!r}), retry {attempt}/{policy.attempts - 1} in {delay:.1f}s")
+				time.sleep(delay)
+				continue
+			if extract_vars is None:
+				checkpoint.fail(city_name, attempt, "Page did not load, skipped")
+			else:
+				checkpoint.done(city_name, extract_vars)
+			return extract_vars
+
+	return scrape_with_retries
+
+def checkpoint_mode(mode: str, disciplines: list = None) -> str:
+	"""Checkpoint name of a run; Advanced runs of only some talent levels are kept apart from full ones"""
+	levels = talent_levels(mode, disciplines)
+	if not levels or len(levels) == len(TALENT_LEVELS):
+		return mode
+	return "-".join([mode] + [url_name(level).replace('%20', '-') for level in levels])
+
+def iter_city_rows(selected_province, mode, skip_error: bool, workers: int = DEFAULT_WORKERS, engine: str = DEFAULT_ENGINE, use_cache: bool = True, retries: int = DEFAULT_RETRIES, on_listed=None, disciplines: list = None, refresh: bool = False, on_cached=None):
+	"""Scrape every city of a province, yielding (province, city, extract_vars) as soon as each city is done
+
+	Cities are scraped concurrently (browsers are bounded by the driver pool) but yielded in province page
+	order. Progress is checkpointed, so a rerun within CHECKPOINT_MAX_AGE resumes where this one stopped
+	(unless `use_cache` is off or `refresh` is on, which scrape every city again). extract_vars is None for a
+	city that failed after `retries` retries or was skipped; see `failure_report`.
+
+	Args:
+		on_listed (callable): called with the province's city names before scraping starts
+		disciplines (list): talent levels (keys of TALENT_LEVELS) detailed in Advanced mode; all by default
+		refresh (bool): list and scrape every city again, saving the results to the city cache (e.g. to compare with a snapshot)
+		on_cached (callable): called with the name of each city whose profile came from the city cache
+	"""
+	pool = get_driver_pool(use_driver, workers)
+	# Only stale or missing cities are scraped; the rest come from the on-disk city cache
+	cache = get_city_cache() if use_cache else None
+	checkpoint = Checkpoint(selected_province, checkpoint_mode(mode, disciplines))
+	levels = talent_levels(mode, disciplines)
+
+	with metrics.labels(selected_province), metrics.span("province listing"):
+		city_names = city_names_of(selected_province, pool, engine, cache, refresh)
+	if on_listed is not None:
+		on_listed(city_names)
+	scrape_city = city_scraper(pool, mode, skip_error, engine)
+	if cache is not None:
+		scrape_city = cached_scraper(scrape_city, cache, selected_province, city_names, levels, refresh, on_cached)
+	else:
+		scrape_city = partial(scrape_city, levels=levels)
+	# Without the cache every city is scraped again; the checkpoint still records failures for the report
+	scrape_city = resumable_scraper(scrape_city, checkpoint, RetryPolicy(attempts=retries + 1), resume=use_cache and not refresh)
+	with ThreadPoolExecutor(max_workers=max(workers, HTTP_WORKERS if engine == "http" else 1)) as executor:
+		for n, (city_name, extract_vars) in enumerate(zip(city_names, executor.map(scrape_city, city_names))):
+			logging.info(f"{n + 1}/{len(city_names)} iteration: {city_name}")
+			yield selected_province, city_name, extract_vars
+	if cache is not None:
+		cache.evict()
+	# A clean run needs no checkpoint; with failures it is kept so the next run only retries those
+	failures = checkpoint.failures()
+	if failures:
+		logging.info(f"{selected_province}: {len(failures)} cities failed, checkpoint kept for resuming")
+	else:
+		checkpoint.remove()
+
+def failure_report(selected_province, mode, disciplines: list = None) -> pd.DataFrame:
+	"""Cities of the latest extraction of a province that failed or were skipped"""
+	failures = Checkpoint(selected_province, checkpoint_mode(mode, disciplines)).failures()
+	return pd.DataFrame(failures, columns=[field.capitalize() for field in CityFailure._fields])
+
+def cache_data(function):
+	"""`function` cached with `st.cache_data`
+
+	Streamlit is imported on the first call, so the CLI never loads it; without Streamlit the function
+	runs uncached.
+	"""
+	cached = []
+	lock = threading.Lock()
+
+	def cached_function():
+		with lock:
+			if not cached:
+				try:
+					import streamlit as st
+					cached.append(st.cache_data()(function))
+				except ImportError:
+					cached.append(function)
+			return cached[0]
+
+	@wraps(function)
+	def call(*args, **kwargs):
+		return cached_function()(*args, **kwargs)
+
+	def clear():
+		clear_cache = getattr(cached_function(), "clear", None)
+		if clear_cache is not None:
+			clear_cache()
+
+	call.clear = clear
+	return call
+
+def extract_province(selected_province, mode, skip_error: bool, workers: int = DEFAULT_WORKERS, engine: str = DEFAULT_ENGINE, use_cache: bool = True, retries: int = DEFAULT_RETRIES, disciplines: tuple = None):
+	"""Extract a province into its tables: talent, infrastructure, business and digital, plus the talent
+	details (graduates by field and specialization of `disciplines`, all levels by default) in Advanced mode
+	"""
+	logging.info(f"Preview started {'(Skipping errors)' if skip_error else ''} with {workers} worker(s), {engine} engine")
  
-	if mode == "simple":
-		logging.info("Columns for simple mode")
-		# COLUMNS
-		talent_columns = ['Total Graduates', 'Higher Education Graduates', 'Technical Vocational Graduates', 'Senior High Graduates', 'Number of Center of Excellence', 'Number of Center of Development', 'Number of Higher Education Institutions', 'Number of Technical Vocational Institutions']
-		infra_columns = ['Office Real Estate', 'Telco Infrastructure', 'Internet Bandwidth', 'Power Supply', 'Transportation Access', 'Hotel Availability', 'Hospital Beds', 'Recreational and Tourist Attractions']
-		business_columns = ['(Cost) Minimum Wage Nonagri', '(Cost) Monthly Office Space Rental per sqm', '(Cost) Grade A', '(Cost) Grade B', '(Cost) Grade C', '(Cost) Monthly Power Rates', 'PEZA IT Parks/Centers', 'Disaster Preparedness Plan', 'Average Crime Solution Efficiency']
-		digital_columns = ['Open Innovation Ecosystem', 'Number of Startups', 'Innovation Policy and Incentives', 'Number of Unicorns']
-
-		for i in talent_columns:
-			talent_df[i] = None
-		for i in infra_columns:
-			infra_df[i] = None
-		for i in business_columns:
-			business_df[i] = None
-		for i in digital_columns:
-			digital_df[i] = None
-  
-		logging.info("Columns for simple mode finished")
-  		# add rows to dataframe
-		# URL is currently at: 'http://www.digitalcitiesph.com/location-profiles/provinces/{province_name}/'
-		logging.info(f"URL is currently at: 'http://www.digitalcitiesph.com/location-profiles/provinces/{province_name}/'")
-  		# Loop through each city
-		for element in elements:
-			# Each heading is named after the city
-			city_name = element.find_element(By.TAG_NAME, 'h6').text
-			new_row = pd.DataFrame({'Province': selected_province, 'City': city_name}, index=[0])
-			talent_df = pd.concat([talent_df, new_row], ignore_index=True)
-			infra_df = pd.concat([infra_df, new_row], ignore_index=True)
-			business_df = pd.concat([business_df, new_row], ignore_index=True)
-			digital_df = pd.concat([digital_df, new_row], ignore_index=True)
-			
-		# Create a list of all the cities from df
-		cities = talent_df['City'].tolist()
-		for n, city_name in enumerate(cities):
-			logging.info(f"{n + 1}/{len(cities)} iteration: {city_name}")
-			talent_df, infra_df, business_df, digital_df = scrape_each_city(city_name, driver, mode, [talent_df, infra_df, business_df, digital_df], [talent_columns, infra_columns, business_columns, digital_columns], skip_error=skip_error)
-
-		talent_table = talent_df
-		infra_table = infra_df
-		business_table = business_df
-		digital_table = digital_df
-		logging.info(f"Finished extracting {selected_province}")
-	elif mode == "advanced":
-		# TODO: Additional table for Talent category
-		pass
-
-	driver.quit()
-
-	return talent_table, infra_table, business_table, digital_table
-
-
-@st.cache_data()
-def export(selected_province, mode: str, filetype: str, skip_error: bool):
+	rows = list(iter_city_rows(selected_province, mode, skip_error, workers=workers, engine=engine, use_cache=use_cache, retries=retries, disciplines=disciplines))
+	# Build the tables in one step from the flat per-city records
+	tables = build_tables(rows, mode)
+	logging.info(f"Finished extracting {selected_province}")
+
+	return tuple(tables)
+
+
+def export_province(selected_province, mode: str, filetype: str, skip_error: bool, workers: int = DEFAULT_WORKERS, engine: str = DEFAULT_ENGINE, use_cache: bool = True, retries: int = DEFAULT_RETRIES, disciplines: tuple = None, on_listed=None):
+	"""Extract a province straight into an export file, writing rows as cities finish
+
+	Args:
+		filetype (str): one of EXPORT_FORMATS ("excel", "csv", "csv.gz", "parquet")
+		on_listed (callable): called with the province's city names before scraping starts
+
+	Returns:
+		bytes: the file, ready for `st.download_button` or to be written to disk
+	"""
 	logging.info(f"{selected_province} {filetype} {mode} Export started")
-	talent_df, infra_df, business_df, digital_df = preview(selected_province, mode, skip_error=skip_error)
-	dfs = [talent_df, infra_df, business_df, digital_df]
-	table_names = ["Talent", "Infrastructure", "Business Environment", "Digital Parameters"]
-
-	#  filetype condition
-	if filetype.lower() == "csv":
-		zip_file = zipfile.ZipFile(f"{selected_province} - Digital Cities PH.zip", "w")
-		buffer = io.BytesIO()
-
-		for i, df in enumerate(dfs):
-			df.to_csv(buffer, index=False, compression='gzip')
-		csv_bytes = buffer.getvalue()
-		for i, df in enumerate(dfs):
-			zip_file.writestr(f"{table_names[i]}.csv", csv_bytes)
-		zip_file.close()
-		logging.info(f"{selected_province} {filetype} {mode} Export Ready")
-		return zip_file
-	elif filetype.lower() == "excel":
-		buffer = io.BytesIO()
-		writer = pd.ExcelWriter(buffer, engine='xlsxwriter')
-		for i, df in enumerate(dfs):
-			#  rename sheet name to table_names[i]
-			df.to_excel(writer, sheet_name=f"{table_names[i]}")
-
-		writer.close()
-
-		file_object = buffer.getvalue()
-		logging.info(f"{selected_province} {filetype} {mode} Export Ready")
-		return file_object
+	exporter = open_exporter(filetype, table_names(mode))
+	chunk = []
+	for row in iter_city_rows(selected_province, mode, skip_error, workers=workers, engine=engine, use_cache=use_cache, retries=retries, disciplines=disciplines, on_listed=on_listed):
+		chunk.append(row)
+		if len(chunk) >= EXPORT_CHUNK_ROWS:
+			exporter.write(build_tables(chunk, mode))
+			chunk = []
+	if chunk:
+		exporter.write(build_tables(chunk, mode))
+	file_object = exporter.close()
+	logging.info(f"{selected_province} {filetype} {mode} Export Ready ({len(file_object)} bytes)")
+	return file_object
+
+# Cached across reruns and sessions of the Streamlit app
+preview = cache_data(extract_province)
+export = cache_data(export_province)
 
 def multitest():
     # return multiple values. show each by multitest().test1, multitest().test2, etc.
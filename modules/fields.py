@@ -0,0 +1,146 @@
+from collections import namedtuple
+
+BASE_URL = 'http://www.digitalcitiesph.com/location-profiles'
+
+TABLE_NAMES = ["Talent", "Infrastructure", "Business Environment", "Digital Parameters"]
+# Extra long-format table of Advanced mode: graduates by field and specialization
+TALENT_DETAILS_TABLE = "Talent Details"
+
+# Accordion that has to be rendered before a tab's fields can be read, by `.filter-nav` tab position
+TAB_CONTENT = {
+	1: "#talentAccordion1",
+	2: "#infraAccordion9",
+	3: "#businessAccordion11",
+	4: "#digitalAccordion11",
+}
+
+# One extracted value of a city profile page.
+#   table: index into TABLE_NAMES (None: extracted but not written to a table)
+#   tab: `.filter-nav` tab (1-4) that has to be open for the value to be visible
+#   by: "css" or "xpath"
+#   strip_commas: drop thousands separators ("1,234" -> "1234")
+Field = namedtuple("Field", ["column", "table", "tab", "by", "selector", "strip_commas"])
+
+POPULATION = Field("Population", None, None, "css", ".score", True)
+
+FIELDS = [
+	#  Talent
+	Field("Total Graduates", 0, 1, "css", "div:nth-child(1) > .details-overall > .score", True),
+	Field("Higher Education Graduates", 0, 1, "css", "#talentAccordion1 > .card > .card-link > span", True),
+	Field("Technical Vocational Graduates", 0, 1, "css", "#talentAccordion2 .collapsed > span", True),
+	Field("Senior High Graduates", 0, 1, "css", "#talentAccordion3 > .card > .collapsed > span", True),
+	Field("Number of Center of Excellence", 0, 1, "css", "#talentAccordion4 span", True),
+	Field("Number of Center of Development", 0, 1, "css", "#talentAccordion5 span", True),
+	Field("Number of Higher Education Institutions", 0, 1, "css", "#talentAccordion6 span", True),
+	Field("Number of Technical Vocational Institutions", 0, 1, "css", "#talentAccordion7 span", True),
+	# Extracted but not part of the Talent table's columns
+	Field("Number of Schools offering Senior High", None, 1, "css", "#talentAccordion8 span", True),
+	#  Infrastructure
+	Field("Office Real Estate", 1, 2, "css", "#infraAccordion9 .card-link > span", False),
+	Field("Telco Infrastructure", 1, 2, "css", "#infraAccordion10 span", False),
+	Field("Internet Bandwidth", 1, 2, "css", "#infraAccordion11 .collapsed > span", False),
+	Field("Power Supply", 1, 2, "css", "#infraAccordion12 .collapsed > span", False),
+	Field("Transportation Access", 1, 2, "xpath", "//div[@id='infraAccordion13']/div/a/span", False),
+	Field("Hotel Availability", 1, 2, "xpath", "(//div[@id='infraAccordion11']/div/a/span)[2]", False),
+	Field("Hospital Beds", 1, 2, "xpath", "(//div[@id='infraAccordion12']/div/a/span)[2]", False),
+	Field("Recreational and Tourist Attractions", 1, 2, "xpath", "(//div[@id='infraAccordion13']/div/a/span)[2]", False),
+	#  Business Environment
+	Field("(Cost) Minimum Wage Nonagri", 2, 3, "css", "li:nth-child(1) > span", True),
+	Field("(Cost) Monthly Office Space Rental per sqm", 2, 3, "css", "li:nth-child(2) > span", False),
+	Field("(Cost) Grade A", 2, 3, "css", "li:nth-child(3) > span", False),
+	Field("(Cost) Grade B", 2, 3, "css", "li:nth-child(4) > span", False),
+	Field("(Cost) Grade C", 2, 3, "css", "li:nth-child(5) > span", False),
+	Field("(Cost) Monthly Power Rates", 2, 3, "css", "li:nth-child(6) > span", False),
+	Field("PEZA IT Parks/Centers", 2, 3, "css", ".collapsed > span", False),
+	Field("Disaster Preparedness Plan", 2, 3, "css", "#businessAccordion11 span", False),
+	Field("Average Crime Solution Efficiency", 2, 3, "css", "#businessAccordion12 span", False),
+	#  Digital Parameters
+	Field("Open Innovation Ecosystem", 3, 4, "css", "#digitalAccordion11 span", False),
+	Field("Number of Startups", 3, 4, "css", "#digitalAccordion13 span", False),
+	Field("Innovation Policy and Incentives", 3, 4, "css", "#digitalAccordion14 span", False),
+	Field("Number of Unicorns", 3, 4, "css", "#digitalAccordion15 span", False),
+]
+
+# Columns whose values are plain numbers (their thousands separators are stripped, see `clean_value`).
+# Counts are stored as nullable integers (Int64), the minimum wage as a nullable float (Float64); every
+# other column keeps the scraped text ("PHP 450 - 600", "1,234 beds"), which `number()` reads in the data store.
+COUNT_COLUMNS = [POPULATION.column] + [field.column for field in FIELDS if field.table == 0]
+COST_COLUMNS = ['(Cost) Minimum Wage Nonagri']
+NUMERIC_COLUMNS = COUNT_COLUMNS + COST_COLUMNS
+
+
+# Advanced mode: talent accordions broken down into graduates by field of study and specialization.
+# An accordion's disciplines may only be rendered once it is expanded, so only requested levels are opened.
+TALENT_LEVELS = {
+	"Higher Education": "#talentAccordion1",
+	"Technical Vocational": "#talentAccordion2",
+	"Senior High": "#talentAccordion3",
+}
+# Inside a talent accordion: the header that expands it, and its body of `.discipline` rows, each with
+# a name and graduate count and optionally `.specialization` rows with their own name and count
+TALENT_HEADER = ".card-link"
+TALENT_BODY = ".collapse"
+# Class Bootstrap adds to an expanded accordion body: a collapsed body stays in the page, and may only be
+# filled with disciplines once it is expanded, so an empty body counts as rendered only when it is shown
+TALENT_SHOWN = "show"
+TALENT_DISCIPLINE = ".discipline"
+TALENT_SPECIALIZATION = ".specialization"
+TALENT_NAME = ".name"
+TALENT_GRADUATES = ".graduates"
+# Key of the talent details in a city's extract_vars: {level: [[field, specialization, graduates], ...]}
+TALENT_DETAILS = "Talent Details"
+TALENT_DETAIL_COLUMNS = ["Level", "Field", "Specialization", "Graduates"]
+
+
+def fields_for(mode: str) -> list:
+	"""Fields extracted in `mode` ("simple" or "advanced"), in page order
+
+	Both modes read the same profile fields; Advanced adds the talent details of TALENT_LEVELS.
+	"""
+	return list(FIELDS)
+
+
+def talent_levels(mode: str, disciplines: list = None) -> list:
+	"""Talent levels to expand in `mode`, in page order: the requested `disciplines` (all by default) in Advanced, none in Simple"""
+	if mode.lower() != "advanced":
+		return []
+	return [level for level in TALENT_LEVELS if disciplines is None or level in disciplines]
+
+
+def table_names(mode: str) -> list:
+	return TABLE_NAMES + [TALENT_DETAILS_TABLE] if mode.lower() == "advanced" else list(TABLE_NAMES)
+
+
+def table_columns(mode: str) -> list:
+	"""Value columns of each table (after Province, City, Population), in TABLE_NAMES order"""
+	columns = [[] for _ in TABLE_NAMES]
+	for field in fields_for(mode):
+		if field.table is not None:
+			columns[field.table].append(field.column)
+	return columns
+
+
+def column_dtype(column: str) -> str:
+	"""Fixed pandas dtype of a table column: Int64 for counts (and talent detail graduates), Float64 for the minimum wage, string otherwise"""
+	if column in COUNT_COLUMNS or column == "Graduates":
+		return "Int64"
+	if column in COST_COLUMNS:
+		return "Float64"
+	return "string"
+
+
+def clean_value(field: Field, text: str) -> str:
+	return text.replace(',', '') if field.strip_commas else text
+
+
+def url_name(name: str) -> str:
+	"""City or province name in URL format (lowercase, spaces replaced with %20)"""
+	return '%20'.join(word.lower() for word in name.split())
+
+
+def province_url(province_name: str) -> str:
+	return f'{BASE_URL}/provinces/{url_name(province_name)}/'
+
+
+def city_url(city_name: str) -> str:
+	return f'{BASE_URL}/cities/{url_name(city_name)}/'
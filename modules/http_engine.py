@@ -0,0 +1,185 @@
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from lxml import html as lxml_html
+from lxml import etree
+import threading
+import logging
+import time
+import requests
+from modules.metrics import metrics
+from modules.fields import (
+	POPULATION, TAB_CONTENT, TALENT_LEVELS, TALENT_BODY, TALENT_SHOWN, TALENT_DISCIPLINE, TALENT_SPECIALIZATION, TALENT_NAME, TALENT_GRADUATES,
+	TALENT_DETAILS, fields_for, talent_levels, clean_value, province_url, city_url,
+)
+
+# Browserless extraction: fetch the server-rendered profile pages and read the same selectors
+# Selenium reads, with lxml instead of one WebDriver round trip per field.
+
+HTTP_TIMEOUT = 15
+HTTP_POOL_SIZE = 16
+HEADERS = {
+	"User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/116.0 Safari/537.36",
+	"Accept": "text/html,application/xhtml+xml",
+}
+
+
+class IncompleteProfile(Exception):
+	"""The fetched page does not contain a value (e.g. it is rendered client-side); use Selenium for it"""
+
+
+# Errors after which a city falls back to the Selenium engine; lxml raises ParserError on an empty or garbled page
+HTTP_ERRORS = (IncompleteProfile, requests.RequestException, etree.LxmlError)
+
+_local = threading.local()
+
+
+def get_session() -> requests.Session:
+	"""Per-thread session with keep-alive connection pooling and retries on transient errors"""
+	session = getattr(_local, "session", None)
+	if session is None:
+		session = requests.Session()
+		retry = Retry(total=2, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504), allowed_methods=("GET",))
+		adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+		session.mount("http://", adapter)
+		session.mount("https://", adapter)
+		session.headers.update(HEADERS)
+		_local.session = session
+	return session
+
+
+def fetch_page(url: str):
+	with metrics.span("http fetch"):
+		response = get_session().get(url, timeout=HTTP_TIMEOUT)
+		response.raise_for_status()
+	with metrics.span("html parse"):
+		return parse_document(response.content)
+
+
+def parse_document(content: bytes):
+	return lxml_html.fromstring(content)
+
+
+def element_text(element) -> str:
+	"""Whitespace-normalized text, matching what WebDriver's `.text` returns for a visible element"""
+	return " ".join(element.text_content().split())
+
+
+def select_text(tree, by: str, selector: str, page: str) -> str:
+	elements = tree.xpath(selector) if by == "xpath" else tree.cssselect(selector)
+	if not elements:
+		raise IncompleteProfile(f"{page}: nothing matches {selector}")
+	return element_text(elements[0])
+
+
+def page_title(tree) -> str:
+	titles = tree.xpath("//title")
+	return element_text(titles[0]) if titles else ""
+
+
+def check_title(tree, city_name: str):
+	title = page_title(tree)
+	if city_name not in title:
+		raise IncompleteProfile(f"Expected {city_name} in {title}")
+
+
+def parse_city(tree, city_name: str, mode: str, levels: list = None) -> dict:
+	"""Read every field of `mode` from a parsed city page
+
+	Args:
+		tree (_type_): lxml document of the city page
+		city_name (str): city name, used for the title check and error messages
+		mode (str): "simple" or "advanced"
+		levels (list): talent levels whose details are read; every level in Advanced mode by default
+
+	Raises:
+		IncompleteProfile: the page is not the city's profile or a value is missing
+
+	Returns:
+		dict: values keyed by column name (including "Population"), same as Selenium's `extract_city`
+	"""
+	check_title(tree, city_name)
+	# Same readiness conditions the Selenium engine waits for: an empty score or tab means client-side rendering
+	population = select_text(tree, POPULATION.by, POPULATION.selector, city_name)
+	if not population:
+		raise IncompleteProfile(f"{city_name}: population is not rendered")
+	extract_vars = {"Population": clean_value(POPULATION, population)}
+	fields = fields_for(mode)
+	for tab in sorted({field.tab for field in fields}):
+		if not select_text(tree, "css", TAB_CONTENT[tab], city_name):
+			raise IncompleteProfile(f"{city_name}: tab {tab} is not rendered")
+	for field in fields:
+		with metrics.span(f"field {field.column}"):
+			extract_vars[field.column] = clean_value(field, select_text(tree, field.by, field.selector, city_name))
+	levels = talent_levels(mode) if levels is None else levels
+	if levels:
+		extract_vars[TALENT_DETAILS] = parse_talent(tree, city_name, levels)
+	return extract_vars
+
+
+def first_text(element, selector: str):
+	matches = element.cssselect(selector)
+	return element_text(matches[0]) if matches else None
+
+
+def parse_talent(tree, city_name: str, levels: list) -> dict:
+	"""Graduates by field and specialization of each talent level, as {level: [[field, specialization, graduates], ...]}
+
+	Raises:
+		IncompleteProfile: an accordion body is not in the page, or is empty and collapsed (filled only when expanded); use Selenium for it
+	"""
+	details = {}
+	for level in levels:
+		with metrics.span("talent details"):
+			bodies = tree.cssselect(f"{TALENT_LEVELS[level]} {TALENT_BODY}")
+			if not bodies:
+				raise IncompleteProfile(f"{city_name}: {level} disciplines are not rendered")
+			rows = []
+			for discipline in bodies[0].cssselect(TALENT_DISCIPLINE):
+				field = first_text(discipline, TALENT_NAME)
+				specializations = discipline.cssselect(TALENT_SPECIALIZATION)
+				if not specializations:
+					rows.append([field, None, first_text(discipline, TALENT_GRADUATES)])
+				for specialization in specializations:
+					rows.append([field, first_text(specialization, TALENT_NAME), first_text(specialization, TALENT_GRADUATES)])
+			if not rows and TALENT_SHOWN not in bodies[0].get("class", "").split():
+				raise IncompleteProfile(f"{city_name}: {level} disciplines are not rendered")
+			details[level] = rows
+	return details
+
+
+def extract_city(city_name: str, mode: str, levels: list = (), profile: bool = True) -> dict:
+	"""Fetch and parse one city profile page without a browser
+
+	Args:
+		levels (list): talent levels whose details are read
+		profile (bool): read the profile fields; False when only talent details are needed
+	"""
+	start_time = time.time()
+	tree = fetch_page(city_url(city_name))
+	if profile:
+		extract_vars = parse_city(tree, city_name, mode, levels)
+	else:
+		check_title(tree, city_name)
+		extract_vars = {TALENT_DETAILS: parse_talent(tree, city_name, levels)}
+	logging.info(f"{city_name} took {time.time() - start_time} seconds to fetch over HTTP")
+	return extract_vars
+
+
+def list_cities(selected_province: str) -> list:
+	"""City/municipality names listed on the province page"""
+	return parse_province(fetch_page(province_url(selected_province)), selected_province)
+
+
+def parse_province(tree, selected_province: str) -> list:
+	"""City/municipality names listed on a parsed province page"""
+	title = page_title(tree)
+	if selected_province not in title:
+		raise IncompleteProfile(f"Expected {selected_province} in {title}")
+	# Each heading is named after the city; an entry without one is skipped rather than failing the province
+	headings = [element.cssselect("h6") for element in tree.cssselect(".municipality")]
+	if not all(headings):
+		logging.warning(f"{selected_province}: {headings.count([])} municipalities without a name skipped")
+	city_names = [element_text(heading[0]) for heading in headings if heading]
+	if not city_names:
+		raise IncompleteProfile(f"{selected_province}: no municipalities in the page")
+	return city_names
@@ -0,0 +1,213 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+import threading
+import logging
+import time
+from modules.extract import iter_city_rows, failure_report, checkpoint_mode, DEFAULT_WORKERS, DEFAULT_ENGINE, DEFAULT_RETRIES
+from modules.snapshots import get_snapshot_store
+from modules.data_store import get_data_store
+from modules.tables import build_tables
+from modules.fields import table_names
+from modules.city_cache import DEFAULT_TTL
+
+# Province extractions running at the same time, across all sessions
+JOB_WORKERS = 2
+# Finished jobs kept so sessions (and other users) can still read their tables
+MAX_FINISHED_JOBS = 20
+# Seconds a finished job is reused (and kept) before a submit extracts the province again; as fresh as the city cache
+JOB_TTL = DEFAULT_TTL
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class Job:
+	"""One province extraction running in the background
+
+	Rows are appended as cities finish, so `tables()` can be rendered while the job is still running.
+
+	Args:
+		province (str): province to extract
+		mode (str): "simple" or "advanced"
+		engine (str): one of ENGINES
+		disciplines (tuple): talent levels detailed in Advanced mode (None for all)
+		options (dict): further keyword arguments of `iter_city_rows`
+	"""
+
+	def __init__(self, province: str, mode: str, engine: str, disciplines: tuple, options: dict):
+		self.province = province
+		self.mode = mode
+		self.engine = engine
+		self.disciplines = disciplines
+		self.options = options
+		self.status = QUEUED
+		self.error = None
+		self.total = None
+		self.submitted = time.time()
+		self.started = None
+		self.finished = None
+		# Id of the snapshot of this job's tables, recorded once it is done
+		self.snapshot = None
+		# Cities whose profile came from the city cache rather than the site
+		self.cached = set()
+		self._rows = []
+		self._lock = threading.Lock()
+
+	@property
+	def key(self) -> tuple:
+		return (self.province, self.mode, self.engine, self.disciplines)
+
+	@property
+	def active(self) -> bool:
+		return self.status in (QUEUED, RUNNING)
+
+	def expired(self, ttl: float = JOB_TTL) -> bool:
+		return self.finished is not None and time.time() - self.finished > ttl
+
+	def progress(self) -> tuple:
+		"""(cities done, cities in the province); the total is None until the province is listed"""
+		with self._lock:
+			return len(self._rows), self.total
+
+	def rows(self) -> list:
+		with self._lock:
+			return list(self._rows)
+
+	def tables(self) -> tuple:
+		"""Talent, infrastructure, business and digital tables (plus talent details in Advanced mode) of the cities finished so far"""
+		return build_tables(self.rows(), self.mode)
+
+	def table_names(self) -> list:
+		return table_names(self.mode)
+
+	def failures(self):
+		return failure_report(self.province, self.mode, self.disciplines)
+
+	def elapsed(self) -> float:
+		if self.started is None:
+			return 0.0
+		return (self.finished or time.time()) - self.started
+
+	def changes(self):
+		"""Values added, removed or changed since the previous snapshot of the province (see `SnapshotStore.diff`), or None before the job is done
+
+		Cities served from the city cache were not extracted again, so they are left out.
+		"""
+		if self.snapshot is None:
+			return None
+		store = get_snapshot_store()
+		changes = store.diff(store.previous(self.snapshot), self.snapshot)
+		return changes[~changes["City"].isin(self.cached)].reset_index(drop=True)
+
+	def _save(self):
+		"""Record a snapshot of the finished tables and load them into the data store"""
+		try:
+			failed = self.failures()["City"].tolist()
+			tables = self.tables()
+			self.snapshot = get_snapshot_store().record(
+				self.province, checkpoint_mode(self.mode, self.disciplines), tables, self.table_names(), failed=failed)
+			get_data_store().load(self.province, tables, self.table_names(), failed=failed)
+		except Exception:
+			# The tables are still there; only the comparison with the next run and the cross-province queries miss them
+			logging.exception(f"Job {self.key}: tables not saved")
+
+	def _listed(self, city_names: list):
+		with self._lock:
+			self.total = len(city_names)
+
+	def _cached(self, city_name: str):
+		with self._lock:
+			self.cached.add(city_name)
+
+	def run(self):
+		self.status = RUNNING
+		self.started = time.time()
+		logging.info(f"Job {self.key} started")
+		try:
+			for row in iter_city_rows(self.province, self.mode, engine=self.engine, disciplines=self.disciplines, on_listed=self._listed, on_cached=self._cached, **self.options):
+				with self._lock:
+					self._rows.append(row)
+			self._save()
+			self.status = DONE
+		except Exception as e:
+			logging.exception(f"Job {self.key} failed")
+			self.error = e
+			self.status = FAILED
+		finally:
+			self.finished = time.time()
+			logging.info(f"Job {self.key} {self.status} after {self.elapsed():.1f} seconds")
+
+
+class JobManager:
+	"""Background worker pool of province extractions, shared by every Streamlit session
+
+	Jobs are deduplicated by (province, mode, engine, disciplines): submitting one that is queued or running (or
+	done within JOB_TTL, unless `refresh`) returns the existing job instead of scraping the province twice.
+	A failed job is always replaced; the new one resumes from the province's checkpoint.
+
+	Args:
+		workers (int): jobs running at the same time; further jobs wait in the queue
+	"""
+
+	def __init__(self, workers: int = JOB_WORKERS):
+		self._executor = ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix="extract-job")
+		self._jobs = OrderedDict()
+		self._lock = threading.Lock()
+
+	def submit(self, province: str, mode: str, engine: str = DEFAULT_ENGINE, disciplines: tuple = None, refresh: bool = False,
+			skip_error: bool = False, workers: int = DEFAULT_WORKERS, use_cache: bool = True, retries: int = DEFAULT_RETRIES) -> Job:
+		"""Start extracting a province, or join the job already extracting it
+
+		Args:
+			disciplines (tuple): talent levels detailed in Advanced mode (None for all)
+			refresh (bool): replace a done job with a new run (cached cities are not scraped again)
+		"""
+		disciplines = tuple(disciplines) if disciplines is not None else None
+		key = (province, mode, engine, disciplines)
+		with self._lock:
+			job = self._jobs.get(key)
+			if job is not None and (job.active or (job.status == DONE and not refresh and not job.expired())):
+				return job
+			job = Job(province, mode, engine, disciplines, dict(skip_error=skip_error, workers=workers, use_cache=use_cache, retries=retries))
+			self._jobs.pop(key, None)
+			self._jobs[key] = job
+			self._forget_finished()
+		self._executor.submit(job.run)
+		return job
+
+	def get(self, province: str, mode: str, engine: str = DEFAULT_ENGINE, disciplines: tuple = None) -> Job:
+		disciplines = tuple(disciplines) if disciplines is not None else None
+		with self._lock:
+			return self._jobs.get((province, mode, engine, disciplines))
+
+	def jobs(self) -> list:
+		with self._lock:
+			return list(self._jobs.values())
+
+	def _forget_finished(self):
+		for key in [key for key, job in self._jobs.items() if job.expired()]:
+			del self._jobs[key]
+		finished = [key for key, job in self._jobs.items() if not job.active]
+		for key in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+			del self._jobs[key]
+
+	def clear_finished(self):
+		"""Forget every finished job, e.g. when the caches are cleared; running jobs are kept"""
+		with self._lock:
+			for key in [key for key, job in self._jobs.items() if not job.active]:
+				del self._jobs[key]
+
+	def shutdown(self, wait: bool = False):
+		self._executor.shutdown(wait=wait, cancel_futures=True)
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager() -> JobManager:
+	"""Process-wide job manager, shared across Streamlit sessions and reruns"""
+	global _manager
+	with _manager_lock:
+		if _manager is None:
+			_manager = JobManager()
+		return _manager
@@ -0,0 +1,129 @@
+from collections import defaultdict, deque
+from contextlib import contextmanager
+import threading
+import json
+import time
+
+# Timing spans of the scraper's hot path (driver start-up, navigation, readiness waits, tab clicks,
+# field extraction), labelled with the province and city being extracted.
+
+PERCENTILES = (0.5, 0.9, 0.95, 0.99)
+
+
+def percentile(sorted_values: list, q: float) -> float:
+	"""Linear-interpolated percentile of already sorted values"""
+	if not sorted_values:
+		return 0.0
+	position = (len(sorted_values) - 1) * q
+	lower = int(position)
+	upper = min(lower + 1, len(sorted_values) - 1)
+	return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def describe(seconds: list) -> dict:
+	values = sorted(seconds)
+	stats = {"count": len(values), "total": sum(values), "mean": sum(values) / len(values) if values else 0.0}
+	for q in PERCENTILES:
+		stats[f"p{int(q * 100)}"] = percentile(values, q)
+	stats["max"] = values[-1] if values else 0.0
+	return stats
+
+
+class Metrics:
+	"""Thread-safe store of timing spans
+
+	Each span is a dict with name, province, city, seconds and ok (False when the block raised).
+	Province and city come from the innermost `labels()` block of the current thread.
+
+	Args:
+		maxlen (int): most recent spans kept
+	"""
+
+	def __init__(self, maxlen: int = 100000):
+		self._lock = threading.Lock()
+		self._spans = deque(maxlen=maxlen)
+		self._context = threading.local()
+
+	@contextmanager
+	def labels(self, province: str = None, city: str = None):
+		"""Label every span recorded by this thread inside the block"""
+		previous = getattr(self._context, "labels", (None, None))
+		self._context.labels = (province or previous[0], city or previous[1])
+		try:
+			yield
+		finally:
+			self._context.labels = previous
+
+	def record(self, name: str, seconds: float, ok: bool = True, province: str = None, city: str = None):
+		"""Add a span; `province`/`city` override the thread's labels (for asyncio tasks sharing a thread)"""
+		context_province, context_city = getattr(self._context, "labels", (None, None))
+		province, city = province or context_province, city or context_city
+		with self._lock:
+			self._spans.append({"name": name, "province": province, "city": city, "seconds": seconds, "ok": ok})
+
+	@contextmanager
+	def span(self, name: str):
+		"""Time the `with` block as span `name`"""
+		start = time.perf_counter()
+		ok = False
+		try:
+			yield
+			ok = True
+		finally:
+			self.record(name, time.perf_counter() - start, ok)
+
+	def spans(self) -> list:
+		with self._lock:
+			return list(self._spans)
+
+	def clear(self):
+		with self._lock:
+			self._spans.clear()
+
+	def summary(self, by: tuple = ("name",)) -> list:
+		"""Count, total, mean, percentiles and max seconds grouped by span fields (e.g. ("province", "name"))"""
+		grouped = defaultdict(list)
+		failures = defaultdict(int)
+		for span in self.spans():
+			key = tuple(span[field] for field in by)
+			grouped[key].append(span["seconds"])
+			failures[key] += not span["ok"]
+		rows = []
+		for key in sorted(grouped, key=lambda key: tuple("" if value is None else str(value) for value in key)):
+			row = dict(zip(by, key))
+			row.update(describe(grouped[key]))
+			row["failed"] = failures[key]
+			rows.append(row)
+		return rows
+
+	def per_city(self) -> list:
+		return self.summary(by=("province", "city", "name"))
+
+	def per_province(self) -> list:
+		return self.summary(by=("province", "name"))
+
+	def to_json(self, indent: int = None) -> str:
+		return json.dumps({
+			"spans": self.summary(),
+			"provinces": self.per_province(),
+			"cities": self.per_city(),
+		}, indent=indent)
+
+	def to_prometheus(self, prefix: str = "digicitiesph") -> str:
+		"""Prometheus text exposition: one summary per span name and province"""
+		metric = f"{prefix}_span_seconds"
+		lines = [f"# HELP {metric} Duration of scraper spans.", f"# TYPE {metric} summary"]
+		for row in self.summary(by=("province", "name")):
+			labels = f'span="{escape_label(row["name"])}",province="{escape_label(row["province"] or "")}"'
+			for q in PERCENTILES:
+				lines.append(f'{metric}{{{labels},quantile="{q}"}} {row[f"p{int(q * 100)}"]:.6f}')
+			lines.append(f"{metric}_sum{{{labels}}} {row['total']:.6f}")
+			lines.append(f"{metric}_count{{{labels}}} {row['count']}")
+		return "\n".join(lines) + "\n"
+
+
+def escape_label(value: str) -> str:
+	return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+metrics = Metrics()
@@ -0,0 +1,116 @@
+from selenium.webdriver.common.by import By
+from selenium.common.exceptions import TimeoutException, NoSuchElementException, StaleElementReferenceException
+import logging
+import time
+from modules.fields import TAB_CONTENT, TALENT_HEADER, TALENT_BODY, TALENT_SHOWN
+from modules.metrics import metrics
+
+# Adaptive polling: start fast for pages that are already rendered, back off for slow ones
+FIRST_POLL = 0.05
+MAX_POLL = 1.0
+BACKOFF = 1.6
+
+# Per-page time budgets (seconds) shared by every wait made on that page
+PROVINCE_PAGE_BUDGET = 30
+CITY_PAGE_BUDGET = 60
+
+IGNORED_EXCEPTIONS = (NoSuchElementException, StaleElementReferenceException)
+
+
+class PageBudget:
+	"""Time budget for one page; every wait on the page draws from it
+
+	Args:
+		page (str): label used when recording waits (e.g. the city name)
+		seconds (float): total seconds all waits on this page may take
+	"""
+
+	def __init__(self, page: str, seconds: float):
+		self.page = page
+		self.seconds = seconds
+		self.deadline = time.monotonic() + seconds
+
+	def remaining(self) -> float:
+		return max(0.0, self.deadline - time.monotonic())
+
+
+def wait_until(driver, condition, name: str, budget: PageBudget):
+	"""Poll `condition(driver)` with adaptive backoff until it returns a truthy value
+
+	Args:
+		driver (_type_): WebDriver
+		condition (callable): takes the driver, returns a truthy value once ready
+		name (str): condition label; the wait is recorded as metrics span "wait <name>"
+		budget (PageBudget): the page's remaining time budget bounds this wait
+
+	Raises:
+		TimeoutException: the condition was not met within the page budget
+
+	Returns:
+		the condition's truthy value
+	"""
+	start = time.monotonic()
+	poll = FIRST_POLL
+	while True:
+		try:
+			value = condition(driver)
+			if value:
+				seconds = time.monotonic() - start
+				metrics.record(f"wait {name}", seconds, True)
+				logging.debug(f"{budget.page}: '{name}' ready after {seconds:.2f}s")
+				return value
+		except IGNORED_EXCEPTIONS:
+			pass
+		remaining = budget.remaining()
+		if remaining <= 0:
+			seconds = time.monotonic() - start
+			metrics.record(f"wait {name}", seconds, False)
+			logging.info(f"{budget.page}: '{name}' timed out after {seconds:.2f}s")
+			raise TimeoutException(f"{budget.page}: '{name}' not ready after {seconds:.2f}s")
+		time.sleep(min(poll, remaining))
+		poll = min(poll * BACKOFF, MAX_POLL)
+
+
+def text_present(css_selector: str):
+	"""Condition: the first element matching `css_selector` exists and has non-empty text"""
+	def _condition(driver):
+		elements = driver.find_elements(By.CSS_SELECTOR, css_selector)
+		if elements and elements[0].text.strip():
+			return elements[0]
+		return False
+	return _condition
+
+
+def wait_for_title(driver, text: str, budget: PageBudget):
+	# expected_conditions pulls in most of the WebDriver package; imported on first use to keep start-up fast
+	from selenium.webdriver.support import expected_conditions as EC
+	return wait_until(driver, EC.title_contains(text), "title", budget)
+
+
+def wait_for_score(driver, budget: PageBudget):
+	"""The headline `.score` (population) is the first value rendered on a city page"""
+	return wait_until(driver, text_present(".score"), "score", budget)
+
+
+def wait_for_municipalities(driver, budget: PageBudget):
+	return wait_until(driver, lambda d: d.find_elements(By.CSS_SELECTOR, ".municipality h6"), "municipalities", budget)
+
+
+def open_tab(driver, position: int, budget: PageBudget):
+	"""Click the `.filter-nav` tab at `position` (1-4) and wait until its accordion content is rendered"""
+	from selenium.webdriver.support import expected_conditions as EC
+	tab_selector = f".filter-nav > li:nth-child({position})"
+	tab = wait_until(driver, EC.element_to_be_clickable((By.CSS_SELECTOR, tab_selector)), f"tab {position} clickable", budget)
+	with metrics.span(f"tab click {position}"):
+		tab.click()
+	return wait_until(driver, text_present(TAB_CONTENT[position]), f"tab {position} content", budget)
+
+
+def open_accordion(driver, accordion: str, budget: PageBudget):
+	"""Expand the talent accordion `accordion` (e.g. "#talentAccordion1") and wait until its body is shown"""
+	from selenium.webdriver.support import expected_conditions as EC
+	header = wait_until(driver, EC.element_to_be_clickable((By.CSS_SELECTOR, f"{accordion} {TALENT_HEADER}")), f"{accordion} clickable", budget)
+	with metrics.span(f"accordion click {accordion}"):
+		header.click()
+	# Bootstrap sets the class once the expand transition is over; the body is visible before that
+	return wait_until(driver, EC.visibility_of_element_located((By.CSS_SELECTOR, f"{accordion} {TALENT_BODY}.{TALENT_SHOWN}")), f"{accordion} content", budget)
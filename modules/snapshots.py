@@ -0,0 +1,289 @@
+from contextlib import closing
+import threading
+import hashlib
+import logging
+import sqlite3
+import json
+import time
+import os
+import pandas as pd
+from modules.city_cache import CACHE_DIR
+from modules.exporters import export_tables, python_value
+from modules.fields import TALENT_DETAILS_TABLE, TALENT_DETAIL_COLUMNS
+from modules.tables import KEY_COLUMNS
+
+# Versioned copies of a province's extracted tables, so a re-extraction can be compared with the last one
+# and only the values that changed are handed on (`export_delta`).
+
+DEFAULT_KEEP = 30  # snapshots kept per province and mode; older ones are pruned
+
+# Table of a delta export: one row per value that was added, removed or changed
+CHANGES_TABLE = "Changes"
+DIFF_COLUMNS = ["Table", "Province", "City", "Column", "Change", "Old", "New"]
+ADDED, REMOVED, CHANGED = "added", "removed", "changed"
+
+# Rows are stored once per distinct content (keyed by digest), so a snapshot that repeats most of the
+# previous one only adds its row keys
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+	id INTEGER PRIMARY KEY AUTOINCREMENT,
+	province TEXT NOT NULL,
+	mode TEXT NOT NULL,
+	taken_at REAL NOT NULL,
+	failed TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS snapshots_province ON snapshots (province, mode, taken_at);
+CREATE TABLE IF NOT EXISTS snapshot_rows (
+	snapshot_id INTEGER NOT NULL,
+	table_name TEXT NOT NULL,
+	row_key TEXT NOT NULL,
+	digest TEXT NOT NULL,
+	PRIMARY KEY (snapshot_id, table_name, row_key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS snapshot_rows_digest ON snapshot_rows (digest);
+CREATE TABLE IF NOT EXISTS row_data (
+	digest TEXT PRIMARY KEY,
+	data TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+def key_columns(table_name: str) -> list:
+	"""Columns identifying a row of `table_name`: (Province, City), plus level, field and specialization for the talent details"""
+	if table_name == TALENT_DETAILS_TABLE:
+		return KEY_COLUMNS + [column for column in TALENT_DETAIL_COLUMNS if column != "Graduates"]
+	return list(KEY_COLUMNS)
+
+
+def text_value(value):
+	"""Cell value as text, None for missing values, so 500, 500.0 and "500" are the same value whatever
+	the dtype the column had in that extraction"""
+	value = python_value(value)
+	if value is None:
+		return None
+	if isinstance(value, float) and value.is_integer():
+		return str(int(value))
+	return str(value)
+
+
+def table_records(table_name: str, table: pd.DataFrame, failed: set) -> list:
+	"""(row_key, digest, data) of each row of `table`, leaving out the cities that failed"""
+	keys = key_columns(table_name)
+	values = [column for column in table.columns if column not in keys]
+	records = []
+	for row in table.itertuples(index=False):
+		row = dict(zip(table.columns, row))
+		if (row["Province"], row["City"]) in failed:
+			continue
+		row_key = json.dumps([text_value(row[column]) for column in keys])
+		data = json.dumps({column: text_value(row[column]) for column in values}, sort_keys=True)
+		records.append((row_key, hashlib.blake2b(data.encode("utf-8"), digest_size=16).hexdigest(), data))
+	return records
+
+
+def changed_values(table_name: str, row_key: str, old: dict, new: dict) -> list:
+	"""Diff rows of one (table, key): a missing value in `old` is added, one missing in `new` removed"""
+	key = json.loads(row_key)
+	province, city, *item = key
+	changes = []
+	for column in list(old) + [column for column in new if column not in old]:
+		# Older snapshots stored numbers rather than text
+		before, after = text_value(old.get(column)), text_value(new.get(column))
+		if before == after:
+			continue
+		change = ADDED if before is None else REMOVED if after is None else CHANGED
+		# A talent detail is identified by its level, field and specialization rather than a column
+		label = " / ".join(str(part) for part in item if part is not None) if item else column
+		changes.append((table_name, province, city, label, change, before, after))
+	return changes
+
+
+class SnapshotStore:
+	"""SQLite store of extraction snapshots keyed by (province, mode)
+
+	`record` saves the tables of one extraction, `diff` compares two snapshots cell by cell on
+	(table, Province, City) and column. Unchanged rows are recognized by their digest without being read.
+
+	Args:
+		path (str): SQLite database file
+		keep (int): snapshots kept per province and mode
+	"""
+
+	def __init__(self, path: str = None, keep: int = DEFAULT_KEEP):
+		self.path = path or os.path.join(CACHE_DIR, "snapshots.sqlite3")
+		self.keep = max(1, int(keep))
+		directory = os.path.dirname(self.path)
+		if directory:
+			os.makedirs(directory, exist_ok=True)
+		with closing(self._connect()) as connection:
+			connection.execute("PRAGMA journal_mode=WAL")
+			connection.executescript(SCHEMA)
+
+	def _connect(self):
+		return sqlite3.connect(self.path, timeout=30)
+
+	def record(self, province: str, mode: str, tables: list, names: list, failed: list = ()) -> int:
+		"""Save the tables of an extraction of `province` as a new snapshot; returns its id
+
+		Args:
+			mode (str): run name, e.g. `checkpoint_mode(mode, disciplines)`
+			tables (list): DataFrames in the order of `names`
+			failed (list): cities that failed in this run; they are left out and not reported as removed
+		"""
+		failed = list(failed)
+		skipped = {(province, city) for city in failed}
+		records = [
+			(name, row_key, digest, data)
+			for name, table in zip(names, tables)
+			for row_key, digest, data in table_records(name, table, skipped)
+		]
+		with closing(self._connect()) as connection, connection:
+			snapshot_id = connection.execute(
+				"INSERT INTO snapshots (province, mode, taken_at, failed) VALUES (?, ?, ?, ?)",
+				(province, mode, time.time(), json.dumps(failed)),
+			).lastrowid
+			connection.executemany("INSERT OR IGNORE INTO row_data (digest, data) VALUES (?, ?)", [(digest, data) for _, _, digest, data in records])
+			connection.executemany(
+				"INSERT OR REPLACE INTO snapshot_rows (snapshot_id, table_name, row_key, digest) VALUES (?, ?, ?, ?)",
+				[(snapshot_id, name, row_key, digest) for name, row_key, digest, _ in records],
+			)
+		logging.info(f"Snapshot {snapshot_id}: {province} {mode}, {len(records)} rows")
+		self.prune(province, mode)
+		return snapshot_id
+
+	def snapshots(self, province: str = None, mode: str = None) -> pd.DataFrame:
+		"""Saved snapshots, newest first"""
+		with closing(self._connect()) as connection:
+			rows = connection.execute(
+				"SELECT s.id, s.province, s.mode, s.taken_at, s.failed, (SELECT COUNT(*) FROM snapshot_rows r WHERE r.snapshot_id = s.id) "
+				"FROM snapshots s WHERE (? IS NULL OR s.province = ?) AND (? IS NULL OR s.mode = ?) ORDER BY s.taken_at DESC, s.id DESC",
+				(province, province, mode, mode),
+			).fetchall()
+		return pd.DataFrame(
+			[(id_, province, mode, pd.Timestamp(taken_at, unit="s"), len(json.loads(failed)), count) for id_, province, mode, taken_at, failed, count in rows],
+			columns=["Id", "Province", "Mode", "Taken at", "Failed cities", "Rows"],
+		)
+
+	def previous(self, snapshot_id: int):
+		"""Id of the snapshot of the same province and mode taken before `snapshot_id`, or None"""
+		with closing(self._connect()) as connection:
+			row = connection.execute(
+				"SELECT p.id FROM snapshots s JOIN snapshots p ON p.province = s.province AND p.mode = s.mode AND p.id < s.id "
+				"WHERE s.id = ? ORDER BY p.id DESC LIMIT 1",
+				(snapshot_id,),
+			).fetchone()
+		return row[0] if row else None
+
+	def latest(self, province: str, mode: str):
+		"""Id of the newest snapshot of `province` in `mode`, or None"""
+		with closing(self._connect()) as connection:
+			row = connection.execute(
+				"SELECT id FROM snapshots WHERE province = ? AND mode = ? ORDER BY id DESC LIMIT 1", (province, mode)
+			).fetchone()
+		return row[0] if row else None
+
+	def tables(self, snapshot_id: int) -> dict:
+		"""Tables of a snapshot as {table name: DataFrame}; values are the text `text_value` stored"""
+		with closing(self._connect()) as connection:
+			rows = connection.execute(
+				"SELECT r.table_name, r.row_key, d.data FROM snapshot_rows r JOIN row_data d ON d.digest = r.digest WHERE r.snapshot_id = ?",
+				(snapshot_id,),
+			).fetchall()
+		records = {}
+		for table_name, row_key, data in rows:
+			row = dict(zip(key_columns(table_name), json.loads(row_key)))
+			row.update(json.loads(data))
+			records.setdefault(table_name, []).append(row)
+		return {table_name: pd.DataFrame.from_records(rows) for table_name, rows in records.items()}
+
+	def diff(self, old_id, new_id: int) -> pd.DataFrame:
+		"""Values added, removed or changed from snapshot `old_id` to `new_id`, one row per value (DIFF_COLUMNS)
+
+		Rows are matched on table and key, and only rows whose digest differs are compared column by column.
+		Without an `old_id` (the first snapshot of a province) every value is added. Cities that failed in
+		`new_id` keep their old values and are not reported.
+		"""
+		with closing(self._connect()) as connection:
+			failed = connection.execute("SELECT province, failed FROM snapshots WHERE id = ?", (new_id,)).fetchone()
+			if failed is None:
+				raise KeyError(f"No snapshot {new_id}")
+			skipped = {(failed[0], city) for city in json.loads(failed[1])}
+			# Rows that are new or whose content changed, then rows that are gone
+			changed = connection.execute(
+				"SELECT n.table_name, n.row_key, o.digest, n.digest FROM snapshot_rows n "
+				"LEFT JOIN snapshot_rows o ON o.snapshot_id = ? AND o.table_name = n.table_name AND o.row_key = n.row_key "
+				"WHERE n.snapshot_id = ? AND (o.digest IS NULL OR o.digest != n.digest)",
+				(old_id, new_id),
+			).fetchall()
+			removed = connection.execute(
+				"SELECT o.table_name, o.row_key, o.digest, NULL FROM snapshot_rows o "
+				"WHERE o.snapshot_id = ? AND NOT EXISTS (SELECT 1 FROM snapshot_rows n WHERE n.snapshot_id = ? AND n.table_name = o.table_name AND n.row_key = o.row_key)",
+				(old_id, new_id),
+			).fetchall()
+			digests = list({digest for _, _, old, new in changed + removed for digest in (old, new) if digest is not None})
+			data = {}
+			# Stay below SQLite's limit of bound parameters
+			for start in range(0, len(digests), 500):
+				batch = digests[start:start + 500]
+				data.update(connection.execute(
+					f"SELECT digest, data FROM row_data WHERE digest IN ({','.join('?' * len(batch))})", batch
+				).fetchall())
+
+		changes = []
+		for table_name, row_key, old, new in changed + removed:
+			province, city = json.loads(row_key)[:2]
+			if new is None and (province, city) in skipped:
+				continue
+			old_values = json.loads(data[old]) if old is not None else {}
+			new_values = json.loads(data[new]) if new is not None else {}
+			changes.extend(changed_values(table_name, row_key, old_values, new_values))
+		# object columns keep integers and text as they were extracted (no float upcast next to missing values)
+		table = pd.DataFrame(changes, columns=DIFF_COLUMNS, dtype=object)
+		return table.sort_values(["Province", "City", "Table", "Column"], kind="stable", ignore_index=True)
+
+	def prune(self, province: str, mode: str) -> int:
+		"""Drop the snapshots of `province` and `mode` beyond the newest `keep`, and rows no snapshot uses"""
+		with closing(self._connect()) as connection, connection:
+			old = [row[0] for row in connection.execute(
+				"SELECT id FROM snapshots WHERE province = ? AND mode = ? ORDER BY id DESC LIMIT -1 OFFSET ?", (province, mode, self.keep)
+			).fetchall()]
+			if not old:
+				return 0
+			placeholders = ",".join("?" * len(old))
+			connection.execute(f"DELETE FROM snapshot_rows WHERE snapshot_id IN ({placeholders})", old)
+			connection.execute(f"DELETE FROM snapshots WHERE id IN ({placeholders})", old)
+			connection.execute("DELETE FROM row_data WHERE digest NOT IN (SELECT digest FROM snapshot_rows)")
+		logging.info(f"Snapshots: pruned {len(old)} old snapshots of {province} {mode}")
+		return len(old)
+
+	def clear(self):
+		with closing(self._connect()) as connection, connection:
+			connection.execute("DELETE FROM snapshot_rows")
+			connection.execute("DELETE FROM row_data")
+			connection.execute("DELETE FROM snapshots")
+
+
+def delta_table(changes: pd.DataFrame) -> pd.DataFrame:
+	"""Diff with old and new values as text, so numbers and text of the same column fit one file column"""
+	table = changes.copy()
+	for column in ("Old", "New"):
+		table[column] = table[column].map(lambda value: None if value is None else str(value)).astype("string")
+	return table
+
+
+def export_delta(changes: pd.DataFrame, filetype: str) -> bytes:
+	"""Delta export: the diff as a single Changes table in any of EXPORT_FORMATS"""
+	return export_tables([delta_table(changes)], filetype, [CHANGES_TABLE])
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_snapshot_store() -> SnapshotStore:
+	"""Process-wide snapshot store at the default location"""
+	global _store
+	with _store_lock:
+		if _store is None:
+			_store = SnapshotStore()
+		return _store
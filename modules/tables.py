@@ -0,0 +1,65 @@
+import pandas as pd
+import logging
+from modules.fields import NUMERIC_COLUMNS, TALENT_DETAILS, TALENT_DETAIL_COLUMNS, table_columns, column_dtype
+
+KEY_COLUMNS = ['Province', 'City']
+
+
+def to_number(series: pd.Series, dtype: str = "Float64") -> pd.Series:
+	"""Parse a column of scraped strings ("1,234", "PHP 420.50") value by value into `dtype`
+
+	The dtype is fixed per column (see `column_dtype`), whatever the rows at hand: a value that is not a
+	number ("N/A"), or not a whole number in an Int64 column, becomes NA instead of changing the column's type.
+	"""
+	cleaned = series.astype("string").str.replace(r"[,\s]|PHP|Php|₱", "", regex=True).replace("", pd.NA)
+	numbers = pd.to_numeric(cleaned, errors="coerce").astype("Float64")
+	if dtype == "Int64":
+		numbers = numbers.where(numbers.mod(1).eq(0))
+	unreadable = int((cleaned.notna() & numbers.isna()).sum())
+	if unreadable:
+		logging.warning(f"{series.name}: {unreadable} values that are not {'whole numbers' if dtype == 'Int64' else 'numbers'} left empty")
+	return numbers.astype(dtype)
+
+
+def build_tables(rows: list, mode: str) -> list:
+	"""Build the four tables in one step from flat per-city records
+
+	Args:
+		rows (list): (province, city, extract_vars) in table order; extract_vars None for a skipped city
+		mode (str): "simple" or "advanced"
+
+	Returns:
+		list: talent, infra, business, digital DataFrames, plus the talent details in Advanced mode
+	"""
+	keys = pd.DataFrame([(province, city_name) for province, city_name, _ in rows], columns=KEY_COLUMNS)
+	values = pd.DataFrame.from_records(
+		[{column: value for column, value in (extract_vars or {}).items() if column != TALENT_DETAILS} for _, _, extract_vars in rows],
+		index=keys.index,
+	)
+	# Every column gets its fixed dtype, even when no city of this batch has a value for it
+	value_columns = list(dict.fromkeys(['Population'] + [column for columns in table_columns(mode) for column in columns]))
+	values = values.reindex(columns=value_columns)
+	for column in value_columns:
+		values[column] = to_number(values[column], column_dtype(column)) if column in NUMERIC_COLUMNS else values[column].astype("string")
+
+	tables = []
+	for columns in table_columns(mode):
+		table = pd.concat([keys, values[['Population'] + columns]], axis=1)
+		tables.append(table)
+	if mode.lower() == "advanced":
+		tables.append(talent_details_table(rows))
+	return tables
+
+
+def talent_details_table(rows: list) -> pd.DataFrame:
+	"""Long-format graduates by level, field and specialization; one row per specialization (or field without any)"""
+	records = [
+		(province, city_name, level, field, specialization, graduates)
+		for province, city_name, extract_vars in rows
+		for level, details in ((extract_vars or {}).get(TALENT_DETAILS) or {}).items()
+		for field, specialization, graduates in details
+	]
+	table = pd.DataFrame.from_records(records, columns=KEY_COLUMNS + TALENT_DETAIL_COLUMNS)
+	for column in table.columns:
+		table[column] = to_number(table[column], column_dtype(column)) if column == "Graduates" else table[column].astype("string")
+	return table